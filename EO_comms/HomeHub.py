@@ -4,15 +4,20 @@
 import time,logging,serial
 import RPi.GPIO as GPIO
 import binascii
+from EO_comms.Transport import Transport
 
 _LOGGER = logging.getLogger(__name__)
 
-class HomeHub(object):
+class HomeHub(Transport):
     EOSerial=None
 
     # GPIO chip reset line (BCM definition)
     NRESET = 16
 
+    # Once a response has started arriving, a gap of this many seconds between bytes means
+    # that nothing more is coming
+    INTER_BYTE_TIMEOUT = 0.05
+
     @classmethod
     def identify_hardware(self):
         # This should always be a Pi3B, but we tend to test for MiniPro2 (RPiZ),
@@ -42,19 +47,41 @@ class HomeHub(object):
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
                 bytesize=serial.EIGHTBITS,
-                timeout=0.4 ) 
+                timeout=self.INTER_BYTE_TIMEOUT )
         self.flush_serial()
         _LOGGER.debug("EO COMMS - HomeHub initialised")
 
     def tx(self,command):
-        self.flush_serial()
+        # Discard anything left over from a previous response, so that it isn't mistaken for
+        # the response to this command
+        if self.EOSerial.in_waiting:
+            self.EOSerial.reset_input_buffer()
         command += '\r'
         self.EOSerial.write(command.encode("ascii"))
     
     def rx(self, recv_delay=3):
-        time.sleep(recv_delay)
-        data = self.EOSerial.read(255)
-        return bytes(data)
+        """
+        Receive a response. Returns as soon as a complete frame (with a valid checksum) has been
+        received, otherwise whatever has been received when the bytes stop arriving for
+        INTER_BYTE_TIMEOUT, or after recv_delay seconds.
+        """
+        # The port's timeout is INTER_BYTE_TIMEOUT, so each read waits at most that long. Until
+        # the response starts, we keep reading until recv_delay, after that a read that times
+        # out is the end of it
+        data=b""
+        deadline=time.monotonic()+recv_delay
+        while len(data)<255:
+            chunk=self.EOSerial.read(max(1,min(self.EOSerial.in_waiting,255-len(data))))
+            if chunk:
+                data+=chunk
+                if self.frame_complete(data):
+                    break
+            elif data:
+                # Bytes have stopped arriving part way through a response
+                break
+            if time.monotonic()>=deadline:
+                break
+        return self.frame(data)
     
 
     def get_ct_readings(self):
@@ -99,7 +126,7 @@ class HomeHub(object):
         
         # Switch baud and timeout back to what it was previously
         self.EOSerial.baudrate = 115200
-        self.EOSerial.timeout = 0.4
+        self.EOSerial.timeout = self.INTER_BYTE_TIMEOUT
 
         # return a dict of ct readings
         return(ct_readings)
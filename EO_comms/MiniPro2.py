@@ -8,6 +8,9 @@ from EO_comms.HomeHub import HomeHub
 
 _LOGGER = logging.getLogger(__name__)
 
+RX_OVERRUNS = globalState.metrics.counter("eo_serial_rx_overruns_total",
+                    "RS485 receive FIFO overruns detected while reading a response")
+
 # The MiniPro3 Comms Library inherits from the HomeHub Comms library
 # Very little code is shared between them at this point, but maintining the relationship between the
 # classes appears to be a reasonable thing to do
@@ -17,6 +20,9 @@ class MiniPro2(HomeHub):
     # GPIO chip reset line (BCM definition)
     NRESET = 16
 
+    # The Mini Pro 2 controller measures the current supplied to the vehicle
+    VEHICLE_CURRENT_FROM_CONTROLLER = True
+
     # Registers for serial comms
     REG_DLL = 0
     REG_DLH = 1
@@ -31,6 +37,9 @@ class MiniPro2(HomeHub):
     REG_RXLVL = 9 # RX Level / Number of bytes awaiting to be read
     REG_EFCR = 15
 
+    # Time between polls of RXLVL while waiting for a response
+    POLL_INTERVAL = 0.001
+
     spi = None
     # bits
     BIT_OVERRUN = 0x02
@@ -47,15 +56,22 @@ class MiniPro2(HomeHub):
         return revision in["900092","900093","9000c1","902120"]
 
 
+    # Each register access is one SPI transaction: a command byte (register address, plus bit 7
+    # set for a read) followed by the data. The UART doesn't auto-increment the address, so
+    # reads of different registers can't share a transaction, but a multi-byte read of the RX
+    # FIFO (RHR, register 0) returns that many bytes from the FIFO in one transaction.
+    FIFO_SIZE = 64
+    FIFO_READ = 0x80
+
     def _register_set(self,reg, val):
-        reg <<= 3
-        self.spi.xfer2([reg, val])
+        self.spi.xfer2([reg<<3, val])
 
     def _register_get(self,reg):
-        reg <<= 3
-        reg |= 0x80
-        res = self.spi.xfer2([reg, 0x00])
-        return res[1]
+        return self.spi.xfer2([(reg<<3)|0x80, 0x00])[1]
+
+    def _fifo_read(self,count):
+        # Read count bytes from the RX FIFO in one burst
+        return bytes(self.spi.xfer2([self.FIFO_READ]+[0x00]*count)[1:])
 
     def __init__(self):
         # Setup GPIO
@@ -88,37 +104,40 @@ class MiniPro2(HomeHub):
 
     def tx(self,command):
         self._register_set(self.REG_FCR_IIR, 0x07)
-        data = [0]
-        for c in command.encode("ascii"):
-            data.append(int(c))
-
-        data.append(int(13))
-        self.spi.xfer2(data)
+        self.spi.xfer2([0]+list(command.encode("ascii"))+[13])
     
     def rx(self, recv_delay=3):
+        """
+        Receive a response. Returns as soon as a complete frame (with a valid checksum) has been
+        received, otherwise whatever has been received after recv_delay seconds. Returns None if
+        there was an overrun.
+
+        Each poll is a read of RXLVL, and if anything is waiting, a burst read of that many bytes
+        from the FIFO. The overrun flag in LSR is held until LSR is read, so it is only checked
+        once, when rx() returns. It is read even if nothing was received, so that an overrun
+        during an exchange that failed isn't blamed on the next response.
+        """
         data=b""
         enter_timestamp = time.monotonic()
 
-        overrun=0
         while (recv_delay is not None) and (time.monotonic() - enter_timestamp < recv_delay):
-            bytesWaiting=int(self._register_get(self.REG_RXLVL))
+            bytesWaiting=min(self._register_get(self.REG_RXLVL),self.FIFO_SIZE)
 
             if (bytesWaiting>0):
-                rxbuffer = [0x80] + [0x00] * bytesWaiting
-                data += bytes(self.spi.xfer2(rxbuffer)[1:])
-                OverrunError = int(self._register_get(self.REG_LSR)) & self.BIT_OVERRUN
-                if (OverrunError!=0):
-                    _LOGGER.debug("rx - Overrun error")
-                    print("Warning - RS485 overrun")
-                    overrun=overrun+1
+                data += self._fifo_read(bytesWaiting)
+                if self.frame_complete(data):
+                    break
             else:
-                time.sleep(0.001)
+                time.sleep(self.POLL_INTERVAL)
 
-        if overrun>0:
-            globalState.stateDict["eo_serial_errors"]=globalState.stateDict["eo_serial_errors"]+1
+        if self._register_get(self.REG_LSR) & self.BIT_OVERRUN:
+            _LOGGER.debug("rx - Overrun error")
+            print("Warning - RS485 overrun")
+            RX_OVERRUNS.inc()
+            self.serial_errors+=1
             return None
         else:
-             return bytes(data)
+             return self.frame(data)
 
     def get_ct_readings(self):
         """
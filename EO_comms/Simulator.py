@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+#################################################################################
+"""
+In-process simulation of the EO controller board and CT sensors, so that openeo can be
+run (and benchmarked) without the hardware, for example:
+
+    OPENEO_SIMULATOR=1 OPENEO_CONFIG_DIR=/tmp/openeo python3 openeo.py
+
+Commands are validated and answered with protocol accurate frames (including checksums).
+A vehicle is plugged in, and the charger state moves through the same states as the real
+controller as the current limit is changed. The simulation can be tuned through the
+environment:
+
+    OPENEO_SIMULATOR_LATENCY       seconds before a response arrives (default 0.01)
+    OPENEO_SIMULATOR_OVERRUN_RATE  fraction of responses lost to overruns (default 0)
+    OPENEO_SIMULATOR_HOUSE_LOAD    site current drawn by everything else, in amps (default 4)
+    OPENEO_SIMULATOR_SOLAR         peak solar generation current, in amps (default 0)
+"""
+#################################################################################
+import os,time,math,random,logging
+from EO_comms.Transport import Transport
+from EO_comms.StatusFrame import StatusFrame
+
+_LOGGER = logging.getLogger(__name__)
+
+class Simulator(Transport):
+
+    # Serial number reported in response to a DISCOVER command
+    SERIAL = "E0000001"
+    FIRMWARE_VERSION = 0x10
+
+    # Charger states (see openeoChargerClass.CHARGER_STATES). Each state is entered through
+    # its "-start" state, which is one less.
+    STATE_IDLE = 6
+    STATE_CAR_CONNECTED = 10
+    STATE_CHARGING = 12
+
+    # Maximum current that the simulated vehicle will draw
+    VEHICLE_MAX_CURRENT = 32
+
+    @classmethod
+    def identify_hardware(self):
+        return os.environ.get("OPENEO_SIMULATOR","") not in ("","0")
+
+    def __init__(self,latency=None,overrun_rate=None,house_load=None,solar=None):
+        self.latency=float(os.environ.get("OPENEO_SIMULATOR_LATENCY",0.01) if latency is None else latency)
+        self.overrun_rate=float(os.environ.get("OPENEO_SIMULATOR_OVERRUN_RATE",0) if overrun_rate is None else overrun_rate)
+        self.house_load=float(os.environ.get("OPENEO_SIMULATOR_HOUSE_LOAD",4) if house_load is None else house_load)
+        self.solar=float(os.environ.get("OPENEO_SIMULATOR_SOLAR",0) if solar is None else solar)
+
+        self.plugged=True
+        self.state=self.STATE_IDLE
+        self.duty=0
+        self.started=time.monotonic()
+        self.charge_started=None
+        self.response=None
+        _LOGGER.info(f"EO COMMS - Simulator initialised (latency {self.latency}s, overrun rate {self.overrun_rate})")
+
+    #############################################################################
+    # Vehicle
+
+    def plug(self):
+        self.plugged=True
+
+    def unplug(self):
+        self.plugged=False
+
+    def vehicle_current(self):
+        # The vehicle draws what it is offered by the duty cycle, up to its maximum
+        if self.state!=self.STATE_CHARGING:
+            return 0
+        return min(self.VEHICLE_MAX_CURRENT,round(self.duty*0.06,1))
+
+    def solar_current(self):
+        # Solar generation follows the sun from 6am to 6pm
+        hour=time.localtime().tm_hour+time.localtime().tm_min/60
+        return round(self.solar*max(0,math.sin(math.pi*(hour-6)/12)),2)
+
+    def next_state(self):
+        if not self.plugged:
+            target=self.STATE_IDLE
+        elif self.duty>0:
+            target=self.STATE_CHARGING
+        else:
+            target=self.STATE_CAR_CONNECTED
+
+        if self.state==target:
+            return target
+        # go through the "-start" state first
+        if self.state==target-1:
+            if target==self.STATE_CHARGING:
+                self.charge_started=time.monotonic()
+            return target
+        return target-1
+
+    #############################################################################
+    # Transport
+
+    def tx(self,command):
+        self.response=None
+        if len(command)<4 or command[0]!="+" or self.checksum(command[:-2])!=command[-2:]:
+            _LOGGER.info(f"EO COMMS - Simulator ignoring invalid command {command!r}")
+            return
+
+        body=command[:-2]
+        if body[1]=="1":
+            # DISCOVER
+            self.response=self.frame_response(self.SERIAL)
+        elif body[1]=="0" and body[2:-3]==self.SERIAL:
+            # SET_LIMIT
+            self.duty=int(body[-3:],16)
+            self.state=self.next_state()
+            self.response=self.status().encode()
+
+    def rx(self, recv_delay=3):
+        response,self.response=self.response,None
+        if response is None:
+            # The controller didn't answer
+            time.sleep(recv_delay)
+            return b""
+
+        time.sleep(min(self.latency,recv_delay))
+        if self.overrun_rate>0 and random.random()<self.overrun_rate:
+            self.serial_errors+=1
+            return None
+        return response
+
+    def get_ct_readings(self):
+        vehicle=self.vehicle_current()
+        solar=self.solar_current()
+        # A little noise, so that charts and smoothing behave as they would on real hardware
+        site=abs(self.house_load+vehicle-solar+random.uniform(-0.2,0.2))
+        return {"site": round(site,2), "vehicle": vehicle, "solar": solar}
+
+    #############################################################################
+    # Responses
+
+    def frame_response(self,payload):
+        text="!"+payload
+        return (text+self.checksum(text)+"\r").encode("ascii")
+
+    def status(self):
+        # The response to a SET_LIMIT command, as decoded by openeoChargerClass.set_amp_limit()
+        charging=self.state==self.STATE_CHARGING
+        return StatusFrame(
+            version=self.FIRMWARE_VERSION,
+            current_switch_setting=6,
+            control_pilot_voltage=900 if self.plugged else 1200,
+            charge_duty=self.duty,
+            plug_present_voltage=1 if self.plugged else 0,
+            # 240V RMS, as the peak to peak reading that the controller reports
+            live_voltage=round(240*2*math.sqrt(2)/0.776),
+            mains_frequency=50,
+            charger_state=self.state,
+            relay_state=1 if charging else 0,
+            plug_state=1 if self.plugged else 0,
+            HUB_duty_limit=self.duty,
+            station_uptime=int(time.monotonic()-self.started),
+            charge_time=int(time.monotonic()-self.charge_started) if charging and self.charge_started else 0,
+            random_value=random.randrange(256),
+            max_current=self.VEHICLE_MAX_CURRENT*10,
+            persistant_ID=self.SERIAL,
+            p1_current=self.vehicle_current())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+#################################################################################
+"""
+Decoder (and encoder) for the controller's response to a SET_LIMIT command, which reports
+the status of the charger:
+
+    '!' + 76 characters of fixed width fields + 2 hex digit checksum + CR
+
+The layout is described once, in FIELDS, from which the slice of each run of adjacent hex
+fields (and of each text field), and the shift and mask of each field within its run, are
+worked out when the module is loaded. A response is decoded in a single pass over that
+table into a StatusFrame, a named tuple with every field typed (e.g. the charger state as an
+int, the phase currents in amps), and is rejected if any field isn't valid or the checksum
+doesn't match. The simulator uses the same table to build its responses.
+"""
+#################################################################################
+import logging
+from collections import namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+# Field types
+HEX = 0         # hex number
+TENTHS = 1      # hex number, in tenths (of an amp)
+TEXT = 2        # string
+
+# (name, width, type) of each field, in the order that they appear in the response
+FIELDS = (
+    ("version", 2, HEX),
+    ("current_switch_setting", 1, HEX),
+    ("control_pilot_voltage", 3, HEX),
+    ("charge_duty", 3, HEX),
+    ("plug_present_voltage", 3, HEX),
+    ("live_voltage", 3, HEX),               # peak to peak
+    ("neutral_voltage", 3, HEX),
+    ("daylight_detection", 3, HEX),
+    ("mains_frequency", 3, HEX),
+    ("charger_state", 2, HEX),              # see openeoChargerClass.CHARGER_STATES
+    ("relay_state", 1, HEX),
+    ("plug_state", 1, HEX),
+    ("HUB_duty_limit", 3, HEX),
+    ("charge_duty_timer", 4, HEX),
+    ("station_uptime", 4, HEX),
+    ("charge_time", 4, HEX),
+    ("state_of_mains", 2, HEX),
+    ("cp_line_state", 1, HEX),
+    ("station_ID", 1, HEX),
+    ("random_value", 2, HEX),
+    ("max_current", 3, HEX),
+    ("persistant_ID", 8, TEXT),
+    ("watchdog_current", 3, HEX),
+    ("watchdog_time", 3, HEX),
+    ("p1_current", 3, TENTHS),
+    ("p2_current", 3, TENTHS),
+    ("p3_current", 3, TENTHS),
+    ("eco_7_switch", 1, HEX),
+)
+
+class StatusFrame(namedtuple("StatusFrame",[name for name,width,kind in FIELDS],
+                             defaults=["" if kind==TEXT else 0 for name,width,kind in FIELDS])):
+    __slots__ = ()
+
+    FIELDS = FIELDS
+
+    # '!', the fields, the checksum and CR
+    LENGTH = 1+sum(width for name,width,kind in FIELDS)+3
+
+    @classmethod
+    def decode(cls,data):
+        """
+        Returns a StatusFrame of the fields in data (the bytes of a complete response, as
+        returned by Transport.rx()), or None if it isn't a valid status response
+        """
+        if len(data)!=cls.LENGTH or data[0]!=0x21 or data[-1]!=0x0D:
+            return cls._invalid(data)
+
+        values=[]
+        try:
+            for span,fields in cls._LAYOUT:
+                part=data[span]
+                if fields is None:
+                    text=part.decode("latin-1")
+                    if not (text.isascii() and text.isprintable()):
+                        return cls._invalid(data)
+                    values.append(text)
+                else:
+                    # int() alone would also accept a sign, underscores or whitespace
+                    if not part.isalnum():
+                        return cls._invalid(data)
+                    run=int(part,16)
+                    values+=[(run>>shift)&mask for shift,mask in fields]
+        except ValueError:
+            return cls._invalid(data)
+
+        # The checksum is the last field of the last run
+        if values.pop()!=sum(data[:-3]) & 0xFF:
+            return cls._invalid(data)
+        for index in cls._TENTHS:
+            values[index]/=10
+        return cls._make(values)
+
+    @staticmethod
+    def _invalid(data):
+        _LOGGER.debug(f"Invalid status response {data!r}")
+        return None
+
+    def encode(self):
+        """
+        Returns the bytes of a response frame holding these values, including checksum
+        """
+        payload=[]
+        for (name,width,kind),value in zip(self.FIELDS,self):
+            if kind==TEXT:
+                payload.append(f"{value:>{width}}"[:width])
+            else:
+                if kind==TENTHS:
+                    value=round(value*10)
+                payload.append(f"{int(value) & (16**width-1):0{width}X}")
+        text="!"+"".join(payload)
+        return (text+"%02X" % (sum(text.encode("ascii")) & 0xFF)+"\r").encode("ascii")
+
+def _layout(fields):
+    """
+    Works out from FIELDS the (slice, fields) of each run of adjacent hex fields, where fields
+    is the (shift, mask) of each field in the run, and the (slice, None) of each text field, in
+    the order that they appear in the response. The checksum is included as a final hex field.
+    """
+    layout=[]
+    run=None
+    position=1
+    for name,width,kind in fields+(("checksum",2,HEX),):
+        if kind==TEXT:
+            layout.append((position,position+width,None))
+            run=None
+        else:
+            if run is None:
+                run=[position,position,[]]
+                layout.append(run)
+            run[1]+=width
+            run[2].append(width)
+        position+=width
+
+    table=[]
+    for start,end,widths in layout:
+        if widths is None:
+            table.append((slice(start,end),None))
+            continue
+        # Fields are shifted out of the run from the right
+        shift=(end-start)*4
+        run_fields=[]
+        for width in widths:
+            shift-=width*4
+            run_fields.append((shift,16**width-1))
+        table.append((slice(start,end),tuple(run_fields)))
+    return tuple(table)
+
+StatusFrame._LAYOUT=_layout(FIELDS)
+StatusFrame._TENTHS=tuple(index for index,(name,width,kind) in enumerate(FIELDS) if kind==TENTHS)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+#################################################################################
+"""
+Interface for communicating with the EO controller board. openeoChargerClass sends
+commands with tx(), and reads the response with rx(). HomeHub (and MiniPro2) talk to the
+real hardware, and Simulator is an in-process stand-in for running without it. tx(), rx()
+and get_ct_readings() are abstract, so a transport that doesn't implement all of them fails
+when it is created, rather than in the I/O thread.
+"""
+#################################################################################
+import logging
+from abc import ABC,abstractmethod
+
+_LOGGER = logging.getLogger(__name__)
+
+class Transport(ABC):
+
+    # Set if the controller measures the vehicle current itself (p1_current in the response to
+    # a SET_LIMIT command), in which case that is used instead of the vehicle CT reading
+    VEHICLE_CURRENT_FROM_CONTROLLER = False
+
+    # Number of failed exchanges (e.g. overruns) seen by rx(). Only written by the hardware I/O
+    # thread; the main loop copies it into globalState.stateDict["eo_serial_errors"]
+    serial_errors = 0
+
+    @classmethod
+    def identify_hardware(self):
+        # True if this transport should be used on the hardware we are running on
+        return False
+
+    @abstractmethod
+    def tx(self,command):
+        """
+        Send a command (a string, including checksum, but without the terminating CR)
+        """
+
+    @abstractmethod
+    def rx(self, recv_delay=3):
+        """
+        Receive a response frame as bytes, waiting up to recv_delay seconds. Returns None
+        (or empty bytes) if nothing usable was received
+        """
+
+    @abstractmethod
+    def get_ct_readings(self):
+        """
+        Returns a dict of CT readings, in amps, with keys "site", "vehicle" and "solar"
+        """
+
+    # Responses from the controller are '!', the payload, a two hex digit checksum, and CR
+    FRAME_END = b"\r"
+
+    @staticmethod
+    def checksum(text):
+        # Two hex digit checksum of a command or response string
+        return "%02X" % (sum(text.encode("ascii")) & 0xFF)
+
+    @staticmethod
+    def frame_complete(data):
+        """
+        True if data ends with a complete response frame, with a valid checksum. The checksum
+        is the sum of the bytes before it (including the leading '!'), modulo 256.
+        """
+        if len(data)<4 or data[-1:]!=Transport.FRAME_END:
+            return False
+        start=data.rfind(b"!",0,-3)
+        if start<0:
+            return False
+        try:
+            checksum=int(data[-3:-1],16)
+        except ValueError:
+            return False
+        return sum(data[start:-3]) & 0xFF == checksum
+
+    @staticmethod
+    def frame(data):
+        """
+        If data ends with a complete frame, strip anything received before it (e.g. the
+        remains of an earlier response)
+        """
+        if Transport.frame_complete(data):
+            return bytes(data[data.rfind(b"!",0,-3):])
+        return bytes(data)
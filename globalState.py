@@ -11,11 +11,18 @@ critical ones.
 
 import logging, os
 from openeoConfig  import openeoConfigClass
+from openeoMetrics import pluginTimingClass, metricsRegistryClass
+from openeoState import stateStoreClass
 
 # Charging current limits (based on EV charging standards)
 MIN_CHARGING_CURRENT = 6  # Minimum safe charging current (IEC 61851)
 MAX_CHARGING_CURRENT = 32  # Maximum hardware current limit
 
+# Period of the main control loop, in seconds. Each loop is started on a fixed deadline
+# so this is the real period, rather than a sleep between iterations. It can be overridden
+# (e.g. to exercise the loop faster with the EO_comms simulator)
+LOOP_INTERVAL = float(os.environ.get("OPENEO_LOOP_INTERVAL",5))
+
 _LOGGER = logging.getLogger(__name__)
 
 def get_os_name():
@@ -120,9 +127,30 @@ stateDict={
     "sys_available_memory" : 0,
     "sys_free_memory" : 0,
     "sys_wifi_strength" : 0,
+    # Number of log entries waiting to be written, and dropped because the queue was full
+    "sys_log_queue_depth" : 0,
+    "sys_log_dropped" : 0,
     # Counter of the number of serial overruns
     "eo_serial_errors": 0,
 
+    # Main loop timing. Duration is the time taken by the loop body, jitter is how late
+    # the loop woke up compared to its deadline, and overruns counts the number of loops
+    # that took longer than LOOP_INTERVAL (skipped_ticks being the number of deadlines missed)
+    "sys_loop_interval": LOOP_INTERVAL,
+    "sys_loop_cycles": 0,
+    "sys_loop_overruns": 0,
+    "sys_loop_skipped_ticks": 0,
+    "sys_loop_duration_ms": 0,
+    "sys_loop_duration_max_ms": 0,
+    "sys_loop_jitter_ms": 0,
+    "sys_loop_jitter_max_ms": 0,
+
+    # Per plugin timing of poll(), sync_state() and configure() (see openeoMetrics), and the
+    # list of plugins whose most recent call exceeded the configured time budget
+    "sys_plugin_timing": {},
+    "sys_slow_plugins": [],
+    "sys_slow_plugin_count": 0,
+
 }
 
 
@@ -141,3 +169,13 @@ defaultConfig = {
         }
 
 configDB = openeoConfigClass(defaultConfig)
+
+# Timing instrumentation for plugin calls made from the main loop (and configserver)
+pluginTiming = pluginTimingClass()
+
+# Counters and histograms exported on /metrics (see openeoMetrics)
+metrics = metricsRegistryClass()
+
+# Versioned copy of the public state, published once per main loop (see openeoState). Anything
+# outside of the main loop (e.g. the configserver) should read the state from here
+stateStore = stateStoreClass()
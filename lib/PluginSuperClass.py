@@ -11,20 +11,43 @@ pluginParamSpec= { "<attributename>": {"type": "(bool|int|float|str|json", "defa
 """
 #################################################################################
 
-import logging,json
+import logging,json,time
 import re, numbers
+from concurrent.futures import ThreadPoolExecutor
+import globalState
 
 # logging for use in this module
 _LOGGER = logging.getLogger(__name__)
 
 class PluginSuperClass:
     
-    # Class variable to indicate how often the poll() method should be called. A value of 1 will
-    # cause poll() to be called every iteration of the main loop, a value of 100 will indicate that
-    # we expect poll() to be called every 100 iterations. A value of 0 indicated that poll() will never be 
-    # called.
+    # Class variable to indicate how often (in seconds) the poll() method should be called. The
+    # main loop runs on a fixed period (globalState.LOOP_INTERVAL), so values are rounded to a whole
+    # number of loops, with a minimum of one. The default of LOOP_INTERVAL will cause poll() to be
+    # called every iteration of the main loop, a value of 60 will cause poll() to be called once a
+    # minute. A value of 0 indicates that poll() will never be called.
     
-    pollfrequency = 1
+    pollinterval = 5
+
+    # Main loop tick at which poll() is next due (see openeo.main()). Polls are due on ticks that
+    # are a multiple of pollinterval, but a poll whose tick was skipped because the main loop
+    # overran is made on the next tick, rather than waiting for the next multiple.
+    next_poll_tick = None
+
+    # Plugins whose poll() does blocking I/O (e.g. network requests or subprocesses) should set
+    # background_poll to True. The main loop will then hand poll() to a worker thread and carry on
+    # using the result of the last completed poll, so that charger control never waits on it. A new
+    # poll is not started until the previous one has completed, and one that takes longer than
+    # background_poll_timeout seconds is reported. Note that Python threads can't be killed, so a
+    # poll that hangs indefinitely will occupy a worker until it returns. A background poll()
+    # must not change globalState.stateDict itself, as the main loop may be iterating over it at
+    # the time, so it should use set_state() instead.
+    background_poll = False
+    background_poll_timeout = 60
+
+    # Worker pool shared by all background polling plugins
+    POLL_WORKERS = 2
+    _poll_executor = None
 
     def _convertType(self,attribute,value,typeClass,default=None):
         """
@@ -76,6 +99,10 @@ class PluginSuperClass:
     pluginConfig={}
     pluginParamSpec={}
     myName=""
+
+    # Version of this module's configuration (see openeoConfigClass.version()) that the plugin
+    # was last configured with
+    config_version=None
     
     def __str__(self):
         return self.myName
@@ -95,10 +122,71 @@ class PluginSuperClass:
             
     def get_user_settings(self):
         return []
+
+    def run_poll(self):
+        """
+        Called by the main loop in place of poll(), recording the time taken. For plugins with
+        background_poll set, poll() is run on the worker pool and the last result is returned.
+        """
+        if not self.background_poll:
+            with globalState.pluginTiming.measure(self.myName,"poll"):
+                return self.poll()
+
+        if self._poll_future is not None and not self._poll_future.done():
+            # Previous poll is still running, so don't start another
+            elapsed=time.monotonic()-self._poll_started
+            if elapsed>self.background_poll_timeout and not self._poll_timed_out:
+                _LOGGER.error(f"Background poll of {self.myName} has not completed after {elapsed:.0f}s")
+                self._poll_timed_out=True
+            return self._poll_result
+
+        if PluginSuperClass._poll_executor is None:
+            PluginSuperClass._poll_executor=ThreadPoolExecutor(max_workers=self.POLL_WORKERS,thread_name_prefix="pluginpoll")
+
+        self._poll_started=time.monotonic()
+        self._poll_timed_out=False
+        self._poll_future=PluginSuperClass._poll_executor.submit(self._background_poll)
+        return self._poll_result
+
+    def set_state(self,key,value):
+        """
+        Set a value in globalState.stateDict from poll(). The values set by a background poll
+        are held until the main loop applies them, with apply_state().
+        """
+        if self.background_poll:
+            self._poll_state[key]=value
+        else:
+            globalState.stateDict[key]=value
+
+    def apply_state(self):
+        """
+        Called by the main loop every iteration, to apply the values set by a completed
+        background poll to globalState.stateDict
+        """
+        if self._poll_state and self._poll_future is not None and self._poll_future.done():
+            state,self._poll_state=self._poll_state,{}
+            globalState.stateDict.update(state)
+
+    def _background_poll(self):
+        # Runs on the worker pool
+        try:
+            with globalState.pluginTiming.measure(self.myName,"poll"):
+                self._poll_result=self.poll()
+        except Exception as e:
+            _LOGGER.error(f"Background poll of {self.myName} failed: {e!r}")
+        if self._poll_timed_out:
+            _LOGGER.warning(f"Background poll of {self.myName} completed after {time.monotonic()-self._poll_started:.0f}s")
     
     def __init__(self,configParam):
         # Store the name of the plugin for reuse elsewhere
         self.myName=re.sub('ClassPlugin$','',type(self).__name__)
+
+        # State of background polling (see run_poll())
+        self._poll_future=None
+        self._poll_started=0
+        self._poll_timed_out=False
+        self._poll_result=0
+        self._poll_state={}
         _LOGGER.debug("Initialising Module: "+self.myName)
         self.configure(configParam)
 
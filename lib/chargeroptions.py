@@ -28,6 +28,7 @@ class chargeroptionsClassPlugin(PluginSuperClass):
                         "charger_name":  {"type": "str","default":"openeo"},
                         "charger_id":  {"type": "str","default":"openeo_1"},
                         "mains_voltage_correction":  {"type": "float","default":77.8},
+                        "plugin_time_budget":  {"type": "float","default":1.0},
                     }
 
     def configure(self, configParam):
@@ -35,6 +36,8 @@ class chargeroptionsClassPlugin(PluginSuperClass):
         globalState.stateDict["eo_overall_limit_current"] = self.pluginConfig["overall_limit_current"]
         globalState.stateDict["charger_name"] = self.pluginConfig["charger_name"]
         globalState.stateDict["charger_id"] = self.pluginConfig["charger_id"]
+        # Time (in seconds) that any plugin call from the main loop should complete within
+        globalState.pluginTiming.budget = self.pluginConfig["plugin_time_budget"]
 
 
     def get_user_settings(self):
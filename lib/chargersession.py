@@ -27,7 +27,7 @@ class chargersessionClassPlugin(PluginSuperClass):
             
     lastloop=datetime.datetime.now()
 
-    SESSION_DB_FILE="/home/pi/etc/session.db"
+    SESSION_DB_FILE=globalState.configDB.CONFIG_DIR+"session.db"
     # The three SESSION_TABLE references are different versions of the 
     # session table schema. When a new schema version is required, the startup will
     # create the table, migrate the old data, and drop the old table. So far I've been supporting
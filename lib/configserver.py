@@ -14,9 +14,10 @@ Configuration example:
 """
 #################################################################################
 import re, logging, threading, json, http.server, socketserver, datetime, socket, os
-import copy, time, numbers, urllib.parse, subprocess,sys
+import copy, time, numbers, urllib.parse, subprocess,sys,gzip,hashlib,collections
 
 import globalState, util
+from openeoMetrics import prometheusExpositionClass
 from lib.PluginSuperClass import PluginSuperClass
 
 import lib.configserver_updater
@@ -26,12 +27,54 @@ import os.path
 # logging for use in this module
 _LOGGER = logging.getLogger(__name__)
 
+# gzip level used for chart data. Chart data compresses well even at low levels, and
+# higher levels cost more CPU on the Pi than they save in transfer
+CHART_COMPRESS_LEVEL = 5
+
+# Seconds between keepalive comments on an idle status stream
+STREAM_KEEPALIVE = 15
+
+class chartCacheClass:
+    """Cache of rendered /getchartdata responses. The data logger only changes when a new
+    datapoint is recorded, which bumps its generation counter, so a rendered response can
+    be reused for any request with the same parameters until then. The ETag is derived from
+    the request parameters and the generation, so clients polling with If-None-Match can be
+    answered with a 304 without any rendering at all."""
+
+    MAX_ENTRIES = 32
+
+    def __init__(self):
+        self.entries=collections.OrderedDict()
+        self.lock=threading.Lock()
+
+    def etag(self,key,generation):
+        return '"%x-%s"' % (generation,hashlib.md5(repr(key).encode("utf-8")).hexdigest()[:12])
+
+    def get(self,key,generation):
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None or entry[0]!=generation:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self,key,generation,body):
+        with self.lock:
+            self.entries[key]=(generation,body)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+
 class ThreadedServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     """This child class allows us to set the REUSEADDR and REUSEPORT options on the socket
     which means the Python task can be started and stopped without breaking the config server
     due to the previous socket being in TIME_WAIT.
     
-    It's now threaded, allowing for multiple requests to be handled in parallel."""
+    It's now threaded, allowing for multiple requests to be handled in parallel. Request threads
+    are daemonic, so that long lived streaming requests don't hold up shutdown."""
+    daemon_threads = True
+
     def server_bind(self):
         # Set socket options before binding
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -71,6 +114,8 @@ class configserverClassPlugin(PluginSuperClass):
         config = {}
         _context = {}
         selected_page = ""
+        chart_cache = chartCacheClass()
+        metrics_exposition = prometheusExpositionClass(globalState.metrics)
 
 
         # Load initial configuration
@@ -110,34 +155,27 @@ class configserverClassPlugin(PluginSuperClass):
             ################################
             # Prometheus exporter
             if format(self.path)=="/metrics":
+                use_gzip = "gzip" in self.headers.get("Accept-Encoding","")
+                body=self.metrics_exposition.get(globalState.stateStore,use_gzip)
+
                 self.send_response(200)
-                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                if use_gzip:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
                 self.end_headers()
-
-                # Dump all global variables in prometheus exporter format
-                for cfgkey,cfgvalue in globalState.stateSnapshot.items():
-                    if cfgkey[0]!="_":
-                        # Convert any bool values to int
-                        if isinstance(cfgvalue, (bool)):
-                            cfgvalue=int(cfgvalue)
-
-                        # Then only show numerics
-                        if isinstance(cfgvalue, numbers.Number):
-                            if (cfgkey=="eo_charger_state_id"):
-                                self.wfile.write(str("# HELP "+cfgkey+" "+globalState.stateSnapshot["eo_charger_state"]+"\n").encode('utf-8'))
-
-                            self.wfile.write(str("# TYPE "+cfgkey+" gauge\n").encode('utf-8'))
-                            self.wfile.write(str(cfgkey+"{} "+str(cfgvalue)+"\n").encode('utf-8'))   
+                self.wfile.write(body)
                 return
 
             ################################
             # Home Assistant
             if format(self.path)=="/api":
                 status={}
-                status["eo_charger_state"]={"id":globalState.stateSnapshot["eo_charger_state_id"],"status":globalState.stateSnapshot["eo_charger_state"]}
+                version,state=globalState.stateStore.snapshot()
+                status["eo_charger_state"]={"id":state["eo_charger_state_id"],"status":state["eo_charger_state"]}
 
 
-                for cfgkey,cfgvalue in globalState.stateSnapshot.items():
+                for cfgkey,cfgvalue in state.items():
                     if cfgkey[0]!="_":
                         if isinstance(cfgvalue, numbers.Number):
                             if (cfgkey!="eo_harger_state_id") and (cfgkey!="eo_charger_state"):
@@ -213,12 +251,53 @@ class configserverClassPlugin(PluginSuperClass):
                     except subprocess.CalledProcessError as e:
                         results[cmd] = f"Error: {e.stderr.strip() or e}"
 
-                # Get Log entries
-                results["log"]=globalState.configDB.logget()
                 self.send_response(200)
                 self.send_header("Content-type", "application/json")
                 self.end_headers()
-                self.wfile.write(json.dumps(results).encode("utf-8"))
+
+                # The log can be large, so rather than building it as a single string, we write the
+                # JSON document up to the start of the "log" string, and then stream the log entries
+                # into it as they are read from the database
+                fields=[f"{json.dumps(key)}: {json.dumps(value)}" for key,value in results.items()]
+                self.wfile.write(("{"+", ".join(fields+['"log": "'])).encode("utf-8"))
+                for row in globalState.configDB.logquery():
+                    self.wfile.write(json.dumps(globalState.configDB.logformat(row))[1:-1].encode("utf-8"))
+                self.wfile.write(b'"}')
+                return
+
+            ###################################################################
+            ## paged/incremental access to the log table, streamed as it is read.
+            ## since=<unix time>, after=<id of last entry seen>, limit=<n>, filter=<text>
+            ## format=text (default) or json (one JSON object per line, including the id)
+            if re.search("^/getlog",self.path):
+                query_components = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                query_format = query_components.get('format', ['text'])[0]
+                query_filter = query_components.get('filter', [None])[0]
+                try:
+                    query_since = query_components.get('since', [None])[0]
+                    query_since = None if query_since is None else int(float(query_since))
+                    query_after = query_components.get('after', [None])[0]
+                    query_after = None if query_after is None else int(query_after)
+                    query_limit = query_components.get('limit', [None])[0]
+                    query_limit = None if query_limit is None else int(query_limit)
+                except ValueError:
+                    self.send_error(400, "Bad Request")
+                    return
+
+                self.send_response(200)
+                if query_format=="json":
+                    self.send_header("Content-type", "application/x-ndjson")
+                else:
+                    self.send_header("Content-type", "text/plain; charset=utf-8")
+                if globalState.stateDict["app_version"]=="0.0" or globalState.stateDict["app_version"]=="main" :
+                    self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+
+                for row in globalState.configDB.logquery(since=query_since,after=query_after,limit=query_limit,filter=query_filter):
+                    if query_format=="json":
+                        self.wfile.write((json.dumps({"id":row[0],"timestamp":row[1],"message":row[2]})+"\n").encode("utf-8"))
+                    else:
+                        self.wfile.write(globalState.configDB.logformat(row).encode("utf-8"))
                 return
             ###################################################################
             ## expose the logger module metrics to the api, if that is available
@@ -233,57 +312,125 @@ class configserverClassPlugin(PluginSuperClass):
                     query_type = query_components.get('type', [''])[0]  # Default to empty string if not found
                     query_since = query_components.get('since', [''])[0]  # Default to empty string if not found
                     query_series = query_components.get('series', [''])[0]  # Default to None if not found
+                    use_gzip = "gzip" in self.headers.get("Accept-Encoding","")
+
+                    # Responses are cached until the next datapoint is recorded
+                    dataLog=globalState.stateDict["_dataLog"]
+                    generation=dataLog.generation
+                    cache_key=(query_type,query_series,query_since,use_gzip)
+                    etag=self.chart_cache.etag(cache_key,generation)
+
+                    if etag in [tag.strip() for tag in self.headers.get("If-None-Match","").split(",")]:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        if globalState.stateDict["app_version"]=="0.0" or globalState.stateDict["app_version"]=="main" :
+                            self.send_header("Access-Control-Allow-Origin", "*")
+                        self.end_headers()
+                        return
 
-                    try:
-                        query_since = datetime.datetime.strptime(query_since,"%Y-%m-%d %H:%M:%S.%f")
-                    except ValueError:
-                        query_since=None
+                    body=self.chart_cache.get(cache_key,generation)
+                    if body is None:
+                        try:
+                            query_since = datetime.datetime.strptime(query_since,"%Y-%m-%d %H:%M:%S.%f")
+                        except ValueError:
+                            query_since=None
 
-                    try:
-                        query_series = query_series.split(",")
-                    except ValueError:
-                        query_series=None
-                    if query_series==['']:
-                        query_series=None
+                        try:
+                            query_series = query_series.split(",")
+                        except ValueError:
+                            query_series=None
+                        if query_series==['']:
+                            query_series=None
+
+                        if (query_type=="plotly"):
+                            body=json.dumps(dataLog.get_plotly(query_since,query_series),default=str)
+                        elif (query_type=="columnar"):
+                            body=json.dumps(dataLog.get_columnar(query_since,query_series),separators=(",",":"))
+                        else:
+                            body=json.dumps(dataLog.get_data(query_since,query_series),default=str)
+                        body=body.encode("utf-8")
+                        if use_gzip:
+                            body=gzip.compress(body,compresslevel=CHART_COMPRESS_LEVEL)
+                        self.chart_cache.put(cache_key,generation,body)
 
                     self.send_response(200)
                     self.send_header("Content-type", "application/json")
                     if globalState.stateDict["app_version"]=="0.0" or globalState.stateDict["app_version"]=="main" :
                         self.send_header("Access-Control-Allow-Origin", "*")
+                    if use_gzip:
+                        self.send_header("Content-Encoding", "gzip")
+                    self.send_header("Vary", "Accept-Encoding")
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", "no-cache")
+                    self.send_header("Content-Length", str(len(body)))
                     self.end_headers()
-
-                    if (query_type=="plotly"):
-
-                            self.wfile.write(json.dumps(globalState.stateDict["_dataLog"].get_plotly(query_since,query_series),default=str).encode("utf-8"))
-                            return
-                    else:
-                            self.wfile.write(json.dumps(globalState.stateDict["_dataLog"].get_data(query_since,query_series),default=str).encode("utf-8"))
-                            return 
+                    self.wfile.write(body)
+                    return
 
                 else:
                     self.send_error(404, "Not Found")
                     return
 
+            ###################################################################
+            ## stream changes to the running status as Server-Sent Events. The status is
+            ## serialised once per main loop by globalState.stateStore, and the same
+            ## messages are written to every connected client
+            if self.path == "/getstatus/stream":
+                self.send_response(200)
+                self.send_header("Content-type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                if globalState.stateDict["app_version"]=="0.0" or globalState.stateDict["app_version"]=="main" :
+                    self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+
+                try:
+                    # Clients reconnecting with an id from this run only need what they missed,
+                    # others start with the whole state
+                    try:
+                        version=globalState.stateStore.parse(self.headers.get("Last-Event-ID"))
+                    except ValueError:
+                        version=0
+                    message=None
+                    if version==0:
+                        version,message=globalState.stateStore.event()
+
+                    while True:
+                        if message is None:
+                            version,message=globalState.stateStore.wait(version,timeout=STREAM_KEEPALIVE)
+                        if message is None:
+                            # comment line, to stop the connection being timed out by proxies
+                            message=b": keepalive\n\n"
+                        self.wfile.write(message)
+                        self.wfile.flush()
+                        message=None
+                except (BrokenPipeError,ConnectionResetError):
+                    pass
+                return
+
             ###################################################################
             ## expose the running status to the api, as recorded in the global dict in cfg
-            if self.path == "/getstatus":
-                # copy is needed to avoid a RuntimeError due to this dict changing size
-                # we can't deepcopy because in some cases the modules within cannot be pickled (e.g. thread objects)
-                status = copy.copy(globalState.stateSnapshot)
-                for x in globalState.stateSnapshot:
-                    if x[0]=="_":
-                        # an underscore denotes a private configuration that probably shouldn't be exposed
-                        status.pop(x,None)
+            if urllib.parse.urlparse(self.path).path == "/getstatus":
+                # The state store only holds public values (an underscore denotes a private
+                # configuration that shouldn't be exposed), already serialised. If a version is
+                # given, then only the values that have changed since then are returned
+                query_components = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                try:
+                    query_since = globalState.stateStore.parse(query_components.get('since', ['0'])[0])
+                except ValueError:
+                    self.send_error(400, "Bad Request")
+                    return
+                version,status=globalState.stateStore.json(query_since)
 
                 self.send_response(200)
                 self.send_header("Content-type", "application/json")
+                self.send_header("X-State-Version", globalState.stateStore.tag(version))
 
                 # required for development and testing only
                 if globalState.stateDict["app_version"]=="0.0" or globalState.stateDict["app_version"]=="main" :
                     self.send_header("Access-Control-Allow-Origin", "*")
 
                 self.end_headers()
-                self.wfile.write(json.dumps(status).encode("utf-8"))
+                self.wfile.write(status.encode("utf-8"))
                 return
             ###################################################################
             ## expose the module settings options
@@ -450,14 +597,25 @@ class configserverClassPlugin(PluginSuperClass):
                 # It is legal for POST keys to be duplicated; that shouldn't happen when saving settings, but #
                 # even if it does, we'll just take the last value we see.
 
+                settings={}
                 for modulekey, value in post_vars:
                     module,key=modulekey.split(':',1)
                     _LOGGER.debug("%r : %r : %r" % (module, key, value))
-                    globalState.configDB.set(module,key,value)
+                    settings.setdefault(module,{})[key]=value
+
+                # Apply the whole form in a single transaction
+                changed_modules=globalState.configDB.set_many(settings)
                 
-                # Now instruct all modules to reconfigure themselves. Probably overkill
-                for modulename,module in globalState.stateDict["_moduleDict"].items():
-                    module.configure(globalState.configDB.get(modulename))
+                # Now instruct the modules whose settings actually changed to reconfigure themselves, so
+                # that the response reflects the new configuration. Recording the version means that
+                # the main loop won't then configure them a second time.
+                for modulename in changed_modules:
+                    module=globalState.stateDict["_moduleDict"].get(modulename)
+                    if module is not None:
+                        config_version=globalState.configDB.version(modulename)
+                        with globalState.pluginTiming.measure(modulename,"configure"):
+                            module.configure(globalState.configDB.get(modulename))
+                        module.config_version=config_version
 
                 self.load_config()
                 configCopy = {}
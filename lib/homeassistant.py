@@ -52,11 +52,23 @@ class homeassistantClassPlugin(PluginSuperClass):
         "device_id": {"type": "str", "default": "openeo_charger_1"},
         "publish_interval": {"type": "int", "default": 5}
     }
+
+    # stateDict keys that are included in the published state. The state is only published on
+    # the publish_interval if one of these (or the configuration) has changed, or at least every
+    # REFRESH_INTERVAL seconds
+    STATE_KEYS = ("eo_charger_state", "eo_charger_state_id", "eo_amps_requested", "eo_amps_limit",
+                  "eo_power_delivered", "eo_power_requested", "eo_live_voltage", "eo_mains_frequency",
+                  "eo_current_site", "eo_current_vehicle", "eo_current_solar", "eo_serial_errors",
+                  "app_version", "openeo_latest_version", "eo_session_kwh", "eo_session_cost")
+    REFRESH_INTERVAL = 300
     
     def __init__(self, configParam):
         self.mqtt_client = None
         self.connected = False
         self.last_publish = 0
+        self.last_refresh = 0
+        self._published_version = 0
+        self._published_config_generation = None
         self.discovery_sent = False
         self._published_schedule_count = 0
         self._published_solar_schedule_count = 0
@@ -912,8 +924,16 @@ class homeassistantClassPlugin(PluginSuperClass):
         try:
             self.mqtt_client.publish(topic, payload, retain=True)
             _LOGGER.debug("Published state to MQTT")
+            self._published_version = globalState.stateStore.version
+            self._published_config_generation = globalState.configDB.generation
+            self.last_refresh = time.time()
         except Exception as e:
             _LOGGER.error(f"Failed to publish state: {e}")
+
+    def _state_changed(self):
+        """True if anything in the published state has changed since it was last published"""
+        version, changes = globalState.stateStore.changes_since(self._published_version, self.STATE_KEYS)
+        return bool(changes) or globalState.configDB.generation != self._published_config_generation
     
     def poll(self):
         """Called by main loop - publish state at configured interval"""
@@ -933,9 +953,10 @@ class homeassistantClassPlugin(PluginSuperClass):
         if self.connected and not self.discovery_sent:
             threading.Thread(target=self._send_discovery, daemon=True).start()
         
-        # Publish state at configured interval
+        # Publish state at configured interval, if it has changed
         if current_time - self.last_publish >= publish_interval:
-            self._publish_state()
+            if self._state_changed() or current_time - self.last_refresh >= self.REFRESH_INTERVAL:
+                self._publish_state()
             self.last_publish = current_time
         
         # Return 0 - this plugin doesn't control charging
@@ -29,6 +29,7 @@ class loadmanagementClassPlugin(PluginSuperClass):
             "ct_offset_site":   {"type": "float", "default": 0.0},
             "ct_offset_vehicle":{"type": "float", "default": 0.0},
             "ct_offset_solar":  {"type": "float", "default": 0.0},
+            "ct_sample_interval": {"type": "float", "default": 0.0},  # 0 - every loop interval
             "solar_enable_threshold": {"type": "int", "default":7},
             "schedule": {"type": "json","default":'[{"start": "0000", "end": "2359", "amps": 0}]'},
             }
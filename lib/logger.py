@@ -2,13 +2,16 @@
 """
 OpenEO Module: Logger
 A module to implement the logging of operational metrics (e.g. power delivered)
-Implemented with fixed size lists. At the moment it does not persist data through
-reboots, but I expect this will come.
+Implemented with fixed size ring buffers of doubles (ringbufferClass), one for recent
+high resolution data, and one for older low resolution data. As datapoints age out of the
+high resolution buffer they are aggregated into lowres_interval buckets, and the low
+resolution buffer stores the mean, minimum and maximum of each bucket, so that short
+spikes are not lost from the longer term charts. Datapoints are persisted
+through restarts in an append-only store (datastoreClass), so each write only adds the
+new datapoints.
 
-The interval (measured in minutes) can be configured in the config file, as can the
-number of datapoints. Default is 5mins and 576 datapoints, for 48 hours of data.
-
-If we have memory issues, we may need to take a different approach.
+The intervals and maximum ages (measured in seconds) can be configured in the config file.
+Default is 5 seconds for an hour, then 5 minutes for 48 hours of data.
 
 Configuration example:
 "logger": {
@@ -24,7 +27,9 @@ Configuration example:
 
 import logging
 from datetime import datetime, timedelta
-import json,hashlib
+import json,hashlib,math,sqlite3,bisect,time
+from array import array
+from threading import Lock
 import globalState
 import re
 from lib.PluginSuperClass import PluginSuperClass
@@ -60,7 +65,7 @@ class loggerClassPlugin(PluginSuperClass):
 
 
         if datetime.now()>self.nextWrite:
-            # Time to record - once every sixty seconds
+            # Time to write new datapoints to disk - once every sixty seconds
             globalState.stateDict["_dataLog"].write()
             self.nextWrite=self.nextWrite+timedelta(seconds=60)
 
@@ -110,10 +115,17 @@ class loggerClassPlugin(PluginSuperClass):
 
 #################################################################################
 class databufferClass:
-    databuffer={}
+
+    # Series that record a state rather than a measurement. Averaging these is meaningless,
+    # so the lowres buffer records the last value in each bucket instead of the mean
+    LAST_VALUE_SERIES = {"eo_charger_state_id"}
+
+    # Suffixes that can be added to a series name to request the bucket minimum or maximum
+    # rather than the mean. For hires datapoints these are just the datapoint itself.
+    AGGREGATES = ("_min","_max")
 
     def __str__(self):
-        return json.dumps(self.databuffer,default=str)
+        return json.dumps(self.get_data(),default=str)
     
     def get_plotly(self,since=None,seriesList=None,subplot_index=None):
         # Returns data in a format compatile with the Plotly Javascript library for
@@ -123,6 +135,8 @@ class databufferClass:
         # in the subplot..
         # spec format example
         #  url='/getchartdata?type=plotly&series=eo_charger_state_id,eo_amps_requested_solar:eo_amps_requested_grid:eo_amps_requested_site_limit:eo_amps_requested:eo_amps_delivered,eo_current_vehicle:eo_current_site:eo_current_solar';
+        # Any series name may be suffixed with _min or _max to chart the minimum or maximum of
+        # each lowres bucket, rather than the mean.
         # Subplots are separated by colons, and the series within a subplot by commas.
         
         myData=self.get_data(since,seriesList)
@@ -151,14 +165,14 @@ class databufferClass:
                             if datum==last_datum:
                                 text.append(None)
                             else:
-                                text.append(openeoChargerClass.CHARGER_STATES[datum])
+                                text.append(openeoChargerClass.CHARGER_STATES.get(datum))
                             last_datum=datum
 
                         series.append({
                             "type": "line",
                             "line": {"shape": 'hv'},
                             "mode": "lines+text",
-                            "name": self.seriesDict[key],
+                            "name": self.series_name(key),
                             "key": key,
                             "stackgroup": None,
                             "x": myData["time"],
@@ -174,7 +188,7 @@ class databufferClass:
                         series.append({
                             "type": "line",
                             "mode": "lines",
-                            "name": self.seriesDict[key],
+                            "name": self.series_name(key),
                             "key": key,
                             "stackgroup": None,
                             "x": myData["time"],
@@ -194,86 +208,182 @@ class databufferClass:
 
 
     def get_data(self,since=None,seriesList=None):
+        # Returns the data from get_columns(), with the times as datetime objects
+        newdatabuffer=self.get_columns(since,seriesList)
+        newdatabuffer["time"]=[datetime.fromtimestamp(timestamp) for timestamp in newdatabuffer["time"]]
+        return newdatabuffer
+
+    def get_columnar(self,since=None,seriesList=None):
+        # Returns data in a compact columnar form for charting. Rather than each series carrying its
+        # own copy of the time axis as strings, there is one shared time axis, given as the start
+        # time and then the difference from the previous datapoint, all in milliseconds since the epoch.
+        # Subplot separators in the series list are ignored, the client already knows the layout.
+        # The names of the charger states are included, to annotate the charger state series with.
+        if seriesList is not None:
+            seriesList=[key for subplot in seriesList for key in subplot.split(":")]
+        columns=self.get_columns(since,seriesList)
+        times=[round(timestamp*1000) for timestamp in columns.pop("time")]
+
+        return {
+            "start": times[0] if times else None,
+            "delta": [current-previous for previous,current in zip(times[:1]+times,times)],
+            "names": {key: self.series_name(key) for key in columns},
+            "labels": {key: openeoChargerClass.CHARGER_STATES for key in columns if key=="eo_charger_state_id"},
+            "series": columns,
+        }
+
+    def get_columns(self,since=None,seriesList=None):
         # Get and return raw data, with optionally providing a subset based on time.
         # the idea there is to allow dynamic updates to a chart, without having to transfer
         # the whole dataset on each update. The javascript could poll based on the maximum
         # time value that it knows about, and request additional datapoints on a regular interval
-        
-        i=None
-
-        if since==None:
-            # Retrieving all datapoints, so look for the first non-null data point and send
-            # all following data points.
-            i=0
-            while (i<len(self.databuffer["time"]) and self.databuffer["time"][i]==None):
-                i=i+1
+        #
+        # The lowres and hires buffers are joined together, oldest first, along with the lowres
+        # bucket that is still being filled in between them. Times are unix timestamps.
+
+        lowres_start=0
+        hires_start=0
+        partial=self.partial_bucket()
+
+        if since is not None:
+            # We only want to send the data since the time specified, so locate the
+            # first datapoint that is later than that with a binary search of the time column.
+            # we always want to retrieve the one before that as well, so that we can detect any
+            # state changes. this might result in duplicate datapoints, but I don't think this is a big issue
+            since=since.timestamp()
+            hires_start=self.hires.bisect(since)-1
+            if hires_start>=0:
+                lowres_start=len(self.lowres)
+                partial=None
+            else:
+                hires_start=0
+                lowres_start=max(0,self.lowres.bisect(since)-1)
 
-            # We want to count from the end of the list, so    
-            i=len(self.databuffer["time"])-i
+        newdatabuffer={}
+        partial_time,partial_values=partial if partial is not None else (None,None)
+        newdatabuffer["time"]=self.lowres.slice("time",lowres_start)+([partial_time] if partial else [])+self.hires.slice("time",hires_start)
 
+        if seriesList is None:
+            keys=list(self.seriesDict)
         else:
-            # We only want to send the data since the time specified, so locate the 
-            # list element that we're interested in
-            i=len(self.databuffer["time"])-1
-            while (i>=0 and self.databuffer["time"][i]!=None and self.databuffer["time"][i]>since):
-                i=i-1
-
-            # we always want to retrieve the last two, so that we can detect any state changes.
-            # this might result in duplicate datapoints, but I don't think this is a big issue
-            i=i-1
-
-            # We want to count from the end of the list, so    
-            i=len(self.databuffer["time"])-i-1
-
-        newdatabuffer={}
+            keys=[key for key in seriesList if self.series_key(key) is not None]
 
-        for key,value in self.databuffer.items():
-            if seriesList is None or key in seriesList or key=="time":
-                newdatabuffer[key]=[] if i==0 else value[-i:]   # [-0:] will return whole list, so if required
-                                                                # to return an empty list here 
+        for key in keys:
+            newdatabuffer[key]=[None if math.isnan(value) else value for value in
+                                self.lowres.slice(key,lowres_start)+
+                                ([partial_values[self.lowres.keys.index(key)]] if partial else [])+
+                                self.hires.slice(self.series_key(key),hires_start)]
 
         return newdatabuffer
 
-        
-
+    def series_key(self,name):
+        # Returns the series that a requested name refers to, allowing for the aggregate
+        # suffixes, or None if it isn't a series that we record
+        if name in self.seriesDict:
+            return name
+        for suffix in self.AGGREGATES:
+            if name.endswith(suffix) and name[:-len(suffix)] in self.seriesDict:
+                return name[:-len(suffix)]
+        return None
+
+    def series_name(self,name):
+        key=self.series_key(name)
+        if key==name:
+            return self.seriesDict[key]
+        return f"{self.seriesDict[key]} {name[len(key)+1:]}"
 
     def push(self,datapoint):
         # datapoint is a dict containing one value per dataseries to store
-        # it is important that we store one point for all series.
-
-        # Only 1:n datapoints should be deleted from the head of the data structure
-        # the remainder should be deleted from the hires/lowres boundary, so we use the
-        # datapoint number and the ratio between hires/lowres to calculate which to delete
-        modulus=self.count%self.ratio
-
-        #if self.databuffer["time"][self.resolution_boundary] is None:
-        #    # We haven't got enough data to care, so simply delete fifo
-        #    deletion_index=0
-        #elif modulus==0:
-        #    deletion_index=0
-        #else:
-        #    deletion_index=self.resolution_boundary
-
-        deletion_index=(self.count%self.ratio!=0)*self.resolution_boundary
-
-        for key in self.databuffer:
-
-            if (key=="time"):
-                self.databuffer["time"].append(datetime.now())
-                del self.databuffer["time"][deletion_index]
-            elif (key in datapoint) and (isinstance(datapoint[key],(int,float))):
-
-                self.databuffer[key].append(datapoint[key])
-                del self.databuffer[key][deletion_index]
+        # it is important that we store one point for all series, so anything missing or
+        # non-numeric is stored as NaN
+        timestamp=datetime.now().timestamp()
+        values=[float(datapoint[key]) if isinstance(datapoint.get(key),(int,float)) else math.nan for key in self.seriesDict]
+
+        self.datastore.append(self.datastore.TIER_HIRES,timestamp,values)
+
+        evicted=self.hires.append(timestamp,values)
+        if evicted is not None:
+            self.downsample(*evicted)
+        self.generation+=1
+
+    def downsample(self,timestamp,values):
+        # Datapoints that age out of the hires buffer are passed here, and accumulated into
+        # buckets of lowres_interval seconds. When a datapoint arrives for a later bucket, the
+        # current bucket is complete, and its mean/min/max are stored in the lowres buffer.
+        bucket=timestamp//self.config["lowres_interval"]
+        if self.bucket is not None and bucket!=self.bucket:
+            self.emit_bucket()
+
+        if self.bucket!=bucket:
+            self.bucket=bucket
+            n=len(self.seriesDict)
+            self.bucket_sum=[0.0]*n
+            self.bucket_count=[0]*n
+            self.bucket_min=[math.nan]*n
+            self.bucket_max=[math.nan]*n
+            self.bucket_last=[math.nan]*n
+
+        for i,value in enumerate(values):
+            if not math.isnan(value):
+                self.bucket_sum[i]+=value
+                self.bucket_count[i]+=1
+                # NaN compares false, so the first value always replaces it
+                if not value>=self.bucket_min[i]:
+                    self.bucket_min[i]=value
+                if not value<=self.bucket_max[i]:
+                    self.bucket_max[i]=value
+                self.bucket_last[i]=value
+
+    def emit_bucket(self):
+        timestamp,values=self.partial_bucket()
+        self.lowres.append(timestamp,values)
+        self.datastore.append(self.datastore.TIER_LOWRES,timestamp,values)
+
+    def partial_bucket(self):
+        # Returns (timestamp, values) of the mean/min/max of the current bucket, in the layout of
+        # the lowres buffer, or None if there isn't one
+        if self.bucket is None:
+            return None
+
+        means=[]
+        for i,key in enumerate(self.seriesDict):
+            if key in self.LAST_VALUE_SERIES:
+                means.append(self.bucket_last[i])
+            elif self.bucket_count[i]>0:
+                means.append(self.bucket_sum[i]/self.bucket_count[i])
             else:
-                self.databuffer[key].append(None)
-                del self.databuffer[key][deletion_index]
-        self.count=self.count+1
+                means.append(math.nan)
+
+        # Buckets are timestamped at the start of the bucket
+        return self.bucket*self.config["lowres_interval"],means+self.bucket_min+self.bucket_max
 
     def write(self):
-        # Writes databuffer to the config database
-        globalState.configDB.set("logger","_loggerFingerpint",self.fingerprint,triggerModuleReonfigure=False)
-        globalState.configDB.set("logger","_loggerData",json.dumps(self.databuffer,default=str),triggerModuleReonfigure=False)
+        # Writes new datapoints to the datastore, and removes those that have aged out
+        now=datetime.now()
+        self.datastore.flush()
+        # hires datapoints are kept until the lowres bucket that they've been aggregated into is
+        # complete, so that the bucket can be rebuilt by load()
+        self.datastore.purge(self.datastore.TIER_HIRES,now-timedelta(seconds=self.config["hires_maxage"]+self.config["lowres_interval"]))
+        self.datastore.purge(self.datastore.TIER_LOWRES,now-timedelta(seconds=self.config["lowres_maxage"]))
+
+    def load(self):
+        # Rebuilds the buffers from the datastore
+        now=datetime.now()
+        interval=self.config["lowres_interval"]
+        for timestamp,values in self.datastore.load(self.datastore.TIER_LOWRES,now-timedelta(seconds=self.config["lowres_maxage"]))[-self.lowres.capacity:]:
+            self.lowres.append(timestamp,values)
+
+        # hires datapoints that had already left the hires buffer, but whose lowres bucket wasn't
+        # complete, are aggregated again to rebuild that bucket
+        hires_cutoff=(now-timedelta(seconds=self.config["hires_maxage"])).timestamp()
+        rows=self.datastore.load(self.datastore.TIER_HIRES,now-timedelta(seconds=self.config["hires_maxage"]+interval))
+        recent=[row for row in rows if row[0]>=hires_cutoff][-self.hires.capacity:]
+        last_bucket=self.lowres[len(self.lowres)-1]//interval if len(self.lowres) else None
+        for timestamp,values in rows[:len(rows)-len(recent)]:
+            if last_bucket is None or timestamp//interval>last_bucket:
+                self.downsample(timestamp,values)
+        for timestamp,values in recent:
+            self.hires.append(timestamp,values)
 
     def __init__(self,config,seriesDict):
         self.config=config
@@ -288,38 +398,206 @@ class databufferClass:
 
         # We use the fingerprint to determine whether the current set of fields being logged
         # matches those that are stored persistently. If it does, then we can load the persistent
-        # record into the dict, if it does not, then we need to start from an empty databuffer.
+        # record into the buffers, if it does not, then we need to start from empty buffers.
         separator=":"
         string=separator.join(seriesDict) 
 
         self.fingerprint=hashlib.md5(string.encode()).hexdigest()
+        self.datastore=datastoreClass(self.fingerprint)
+
+        # calculate the number of datapoints in each buffer
+        hires_datapoints=round(config["hires_maxage"]/config["hires_interval"])
+        lowres_datapoints=round((config["lowres_maxage"]-config["hires_maxage"])/config["lowres_interval"])
+
+        # The lowres bucket that datapoints leaving the hires buffer are currently being aggregated into
+        self.bucket=None
+
+        # Incremented whenever the data changes, so that anything derived from it can tell if it is
+        # out of date. Started from the clock, so that it isn't reused by a later instance.
+        self.generation=time.time_ns()
+
+        # The lowres buffer holds the mean, then the minimum, then the maximum of each series
+        self.hires=ringbufferClass(hires_datapoints,seriesDict)
+        self.lowres=ringbufferClass(lowres_datapoints,list(seriesDict)+
+                                    [key+suffix for suffix in self.AGGREGATES for key in seriesDict])
+
+        # Previous versions stored the whole databuffer as JSON in the config database. If that's
+        # there, then migrate it to the datastore, and remove it from the config.
         lastfingerprint=globalState.configDB.get("logger","_loggerFingerpint","")
+        legacyData=globalState.configDB.get("logger","_loggerData")
+        if legacyData is not None:
+            if self.fingerprint==lastfingerprint and self.datastore.empty():
+                self.migrate(legacyData)
+            globalState.configDB.delete("logger","_loggerFingerpint")
+            globalState.configDB.delete("logger","_loggerData")
+
+        self.load()
+
+    def migrate(self,legacyData):
+        # Copies datapoints from the legacy JSON representation of the databuffer into the datastore
+        try:
+            legacyBuffer=json.loads(legacyData)
+            times=legacyBuffer["time"]
+            for i,timeValue in enumerate(times):
+                if timeValue is None:
+                    continue
+                # work out which section this datapoint was in by counting back from the end
+                tier=self.datastore.TIER_HIRES if len(times)-i<=self.hires.capacity else self.datastore.TIER_LOWRES
+                values=[legacyBuffer.get(key,[None]*len(times))[i] for key in self.seriesDict]
+                values=[math.nan if value is None else value for value in values]
+                if tier==self.datastore.TIER_LOWRES:
+                    # The JSON buffer only held the mean of each lowres datapoint, which is the best
+                    # there is for the minimum and maximum
+                    values=values*3
+                self.datastore.append(tier,datetime.fromisoformat(timeValue).timestamp(),values)
+            self.datastore.flush()
+        except Exception as e:
+            _LOGGER.error(f"Unable to migrate logger data: {e!r}")
 
-        # calculate the number of datapoints
-        datapoints=round(config["hires_maxage"]/config["hires_interval"]) + \
-            round((config["lowres_maxage"]-config["hires_maxage"])/config["lowres_interval"])
-        
-        if (self.fingerprint==lastfingerprint):
-            # Load data from config
-            try:
-                self.databuffer=json.loads(globalState.configDB.get("logger","_loggerData",""))
-                # re-encode time data as time objects, because we serialise them as strings when we save it
-                for i,timeValue in enumerate(self.databuffer["time"]):
-                    if isinstance(self.databuffer["time"][i],str):
-                        self.databuffer["time"][i]=datetime.fromisoformat(timeValue)
-            except:
-                pass
-        
-        if len(self.databuffer)==0:
-            # Construct the databuffer
-            self.databuffer["time"]=[None] * datapoints
-            for series in seriesDict:
-                self.databuffer[series]=[None] * datapoints
-        
-        # find ratio of hires/lowres
-        self.ratio=self.config["lowres_interval"]/self.config["hires_interval"]
-        # find hires/lowres boundary
-        self.resolution_boundary=datapoints-int(self.config["hires_maxage"]/self.config["hires_interval"])
 
-        # datapoint count
-        self.count=0
+#################################################################################
+class ringbufferClass:
+    """
+    Fixed capacity buffer of datapoints, holding a time column and one column per series,
+    each an array of doubles. Appending is O(1); once full, each append overwrites (and
+    returns) the oldest datapoint. Datapoints are addressed by position, oldest first, and
+    since they are appended in time order, positions can be found by bisecting on time.
+    """
+
+    def __init__(self,capacity,keys):
+        self.capacity=max(0,capacity)
+        self.keys=list(keys)
+        self.columns={key: array('d',[math.nan])*self.capacity for key in ["time"]+self.keys}
+        # Physical index of the oldest datapoint, and the number of datapoints held
+        self.start=0
+        self.length=0
+
+    def __len__(self):
+        return self.length
+
+    def append(self,timestamp,values):
+        # values is a sequence of floats in the same order as keys. Returns (timestamp, values)
+        # for the datapoint that was overwritten, or None if the buffer wasn't full
+        if self.capacity==0:
+            return (timestamp,values)
+
+        evicted=None
+        if self.length==self.capacity:
+            index=self.start
+            evicted=(self.columns["time"][index],[self.columns[key][index] for key in self.keys])
+            self.start=(self.start+1)%self.capacity
+        else:
+            index=(self.start+self.length)%self.capacity
+            self.length=self.length+1
+
+        self.columns["time"][index]=timestamp
+        for key,value in zip(self.keys,values):
+            self.columns[key][index]=value
+
+        return evicted
+
+    def __getitem__(self,position):
+        # Timestamp of the datapoint at the given position. Together with __len__, this allows
+        # the bisect module to search the time column directly, as it is always in order
+        if not 0<=position<self.length:
+            raise IndexError(position)
+        return self.columns["time"][(self.start+position)%self.capacity]
+
+    def bisect(self,timestamp):
+        # Returns the position of the first datapoint later than timestamp
+        return bisect.bisect_right(self,timestamp)
+
+    def slice(self,key,start=0):
+        # Returns the column (or "time") from the given position to the end as a list, oldest first
+        column=self.columns[key]
+        first=self.start+start
+        last=self.start+self.length
+        if start>=self.length:
+            return []
+        if last<=self.capacity:
+            return column[first:last].tolist()
+        if first>=self.capacity:
+            return column[first-self.capacity:last-self.capacity].tolist()
+        return column[first:].tolist()+column[:last-self.capacity].tolist()
+
+
+#################################################################################
+class datastoreClass:
+    """
+    Append-only on-disk store for logger datapoints. Each datapoint is a row holding a timestamp
+    and the values of every series, packed as an array of doubles (NaN standing in for None).
+    Rows are buffered in memory and written in a single transaction by flush(), so each write only
+    adds new datapoints, and old rows are removed with an indexed delete by purge().
+    """
+    DB_FILE=globalState.configDB.CONFIG_DIR+"datalog.db"
+    DATA_TABLE="datalog"
+    META_TABLE="datalog_meta"
+
+    # Datapoints in the hires section of the buffer, and those that have been retained in the lowres section
+    TIER_HIRES=0
+    TIER_LOWRES=1
+
+    def __init__(self,fingerprint):
+        self.pending=[]
+        self.lock=Lock()
+
+        self.conn = sqlite3.connect(self.DB_FILE, check_same_thread=False)
+        self.conn.execute('pragma journal_mode=wal')
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.DATA_TABLE} (
+                tier INTEGER NOT NULL,
+                timestamp REAL NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        self.conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS {self.DATA_TABLE}_tier_timestamp ON {self.DATA_TABLE} (tier, timestamp)
+        ''')
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.META_TABLE} (
+                key TEXT PRIMARY KEY,
+                value
+            )
+        ''')
+
+        # If the set of series has changed, then the stored data can't be used
+        row=self.conn.execute(f"SELECT value FROM {self.META_TABLE} WHERE key='fingerprint'").fetchone()
+        if row is None or row[0]!=fingerprint:
+            _LOGGER.info("Logger series have changed, discarding stored data")
+            self.conn.execute(f"DELETE FROM {self.DATA_TABLE}")
+            self.conn.execute(f"REPLACE INTO {self.META_TABLE} (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+        self.conn.commit()
+
+    def empty(self):
+        with self.lock:
+            return self.conn.execute(f"SELECT 1 FROM {self.DATA_TABLE} LIMIT 1").fetchone() is None
+
+    def append(self,tier,timestamp,values):
+        # Queue a datapoint (unix timestamp, and a sequence of floats) to be written on the next flush()
+        self.pending.append((tier,timestamp,array('d',values).tobytes()))
+
+    def flush(self):
+        pending,self.pending=self.pending,[]
+        if pending:
+            with self.lock:
+                self.conn.executemany(f"INSERT INTO {self.DATA_TABLE} (tier, timestamp, data) VALUES (?, ?, ?)", pending)
+                self.conn.commit()
+
+    def purge(self,tier,before):
+        with self.lock:
+            self.conn.execute(f"DELETE FROM {self.DATA_TABLE} WHERE tier=? AND timestamp<?", (tier,before.timestamp()))
+            self.conn.commit()
+
+    def load(self,tier,since):
+        # Returns a list of (unix timestamp, array of values) for the tier, oldest first
+        with self.lock:
+            rows=self.conn.execute(f'''
+                SELECT timestamp, data FROM {self.DATA_TABLE} WHERE tier=? AND timestamp>=? ORDER BY timestamp
+            ''', (tier,since.timestamp())).fetchall()
+
+        result=[]
+        for timestamp,data in rows:
+            values=array('d')
+            values.frombytes(data)
+            result.append((timestamp,values))
+        return result
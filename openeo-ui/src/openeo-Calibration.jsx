@@ -1,4 +1,5 @@
 import React, { useEffect, useRef, useState,useCallback } from "react";
+import { chartUrl,columnarToPlotly } from './utils/charts';
 import { buildUrl } from './utils/funcs';
 import { globalCss,styles } from './utils/styles';
 import { useToastContext } from "./openeo-Toast";
@@ -26,7 +27,8 @@ export default function Calibration() {
   const chartDataRef = useRef([]); // Ref to hold the current chart data for updates
   const plotlyRef = useRef(null);  // Ref to hold the Plotly library once loaded
 
-  const url=`getchartdata?type=plotly&series=eo_current_raw_vehicle,eo_current_raw_site,eo_current_raw_solar`
+  const series=`eo_current_raw_vehicle,eo_current_raw_site,eo_current_raw_solar`
+  const url=chartUrl(series)
 
   const layout = {
     margin: { l: 30, r: 0, b: 30, t: 0 },
@@ -118,6 +120,7 @@ export default function Calibration() {
     const maxTime = chartData[0].x_orig[chartData[0].x.length - 1];
     fetch(buildUrl(url + "&since=" + maxTime), { method: "GET" })
       .then((r) => r.json())
+      .then((data) => columnarToPlotly(data, series))
       .then((data) => {
 
         // Mutate X strings to Date objects for Plotly
@@ -180,6 +183,7 @@ export default function Calibration() {
             // Now get initial data
             fetch(buildUrl(url), { method: "GET" })
               .then((r) => r.json())
+              .then((data) => columnarToPlotly(data, series))
               .then((data) => {
                 let trimmedData = data.map(trace => ({
                   ...trace,
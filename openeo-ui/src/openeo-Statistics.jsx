@@ -1,4 +1,5 @@
 import React, { useEffect, useRef } from "react";
+import { chartUrl,columnarToPlotly } from './utils/charts';
 import { buildUrl } from './utils/funcs';
 import { globalCss,styles } from './utils/styles';
 
@@ -8,8 +9,9 @@ export default function Statistics() {
   const chartDataRef = useRef([]);
   const plotlyRef = useRef(null);
 
-  const url =
-    "getchartdata?type=plotly&series=eo_charger_state_id,eo_amps_requested_solar:eo_amps_requested_grid:eo_amps_requested_site_limit:eo_amps_requested:eo_amps_delivered,eo_current_vehicle:eo_current_site:eo_current_solar";
+  const series =
+    "eo_charger_state_id,eo_amps_requested_solar:eo_amps_requested_grid:eo_amps_requested_site_limit:eo_amps_requested:eo_amps_delivered,eo_current_vehicle:eo_current_site:eo_current_solar";
+  const url = chartUrl(series);
 
   const layout = {
     grid: { rows: 3, columns: 1, pattern: "independent" },
@@ -93,6 +95,7 @@ export default function Statistics() {
 
     fetch(buildUrl(url + "&since=" + maxTime), { method: "GET" })
       .then((r) => r.json())
+      .then((data) => columnarToPlotly(data, series))
       .then((data) => {
         data.forEach((series, i) => {
           chartData[i].x.push(...series.x);
@@ -125,6 +128,7 @@ export default function Statistics() {
 
       fetch(buildUrl(url), { method: "GET" })
         .then((r) => r.json())
+        .then((data) => columnarToPlotly(data, series))
         .then((data) => {
           processData(data);
           chartDataRef.current = data;
@@ -1,4 +1,5 @@
 import React, { useEffect, useRef } from "react";
+import { chartUrl,columnarToPlotly } from './utils/charts';
 import { buildUrl } from './utils/funcs';
 import { globalCss,styles } from './utils/styles';
 
@@ -8,7 +9,8 @@ export default function StatisticsOS() {
   const chartDataRef = useRef([]);
   const plotlyRef = useRef(null);
 
-  const url='getchartdata?type=plotly&series=sys_cpu_temperature:sys_wifi_strength,sys_1m_load_average,sys_free_memory:sys_available_memory,eo_serial_errors';
+  const series='sys_cpu_temperature:sys_wifi_strength,sys_1m_load_average,sys_free_memory:sys_available_memory,eo_serial_errors';
+  const url=chartUrl(series);
 
   const layout = {
     grid: { rows: 4, columns: 1, pattern: "independent" },
@@ -93,6 +95,7 @@ export default function StatisticsOS() {
     const maxTime = chartData[0].x[chartData[0].x.length - 1];
     fetch(buildUrl(url + "&since=" + maxTime), { method: "GET" })
       .then((r) => r.json())
+      .then((data) => columnarToPlotly(data, series))
       .then((data) => {
         data.forEach((series, i) => {
           chartData[i].x.push(...series.x);
@@ -125,6 +128,7 @@ export default function StatisticsOS() {
 
       fetch(buildUrl(url), { method: "GET" })
         .then((r) => r.json())
+        .then((data) => columnarToPlotly(data, series))
         .then((data) => {
           processData(data);
           chartDataRef.current = data;
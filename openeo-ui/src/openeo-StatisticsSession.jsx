@@ -1,4 +1,5 @@
 import React, { useEffect, useRef } from "react";
+import { chartUrl,columnarToPlotly } from './utils/charts';
 import { buildUrl,getCurrencyConfig } from './utils/funcs';
 import { globalCss,styles } from './utils/styles';
 
@@ -23,7 +24,8 @@ export default function StatisticsSession() {
   const chartDataRef = useRef([]);
   const plotlyRef = useRef(null);
 
-  const url='getchartdata?type=plotly&series=eo_session_current_tariff:eo_session_current_tariff,eo_session_kwh:,eo_session_cost:';
+  const series='eo_session_current_tariff:eo_session_current_tariff,eo_session_kwh:,eo_session_cost:';
+  const url=chartUrl(series);
 
   const layout = {
     grid: { rows: 3, columns: 1, pattern: "independent" },
@@ -99,6 +101,7 @@ export default function StatisticsSession() {
     const maxTime = chartData[0].x[chartData[0].x.length - 1];
     fetch(buildUrl(url + "&since=" + maxTime), { method: "GET" })
       .then((r) => r.json())
+      .then((data) => columnarToPlotly(data, series))
       .then((data) => {
         data.forEach((series, i) => {
           chartData[i].x.push(...series.x);
@@ -131,6 +134,7 @@ export default function StatisticsSession() {
 
       fetch(buildUrl(url), { method: "GET" })
         .then((r) => r.json())
+        .then((data) => columnarToPlotly(data, series))
         .then((data) => {
           processData(data);
           chartDataRef.current = data;
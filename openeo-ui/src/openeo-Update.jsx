@@ -1,5 +1,6 @@
 import { useState, useEffect, useRef } from "react";
 import { buildUrl } from './utils/funcs';
+import { subscribeStatus } from './utils/status';
 import { globalCss,styles } from './utils/styles';
 import { useToastContext } from "./openeo-Toast";
 
@@ -21,18 +22,13 @@ export default function Update({ status = {} }) {
     ALLOWED_OS_VERSIONS.includes(versionInfo.os_version);
 
     
-  const fetchVersionInfo = () => {
-    fetch(buildUrl("getstatus"))
-      .then((r) => r.json())
-      .then((data) => {
-        setVersionInfo({
-          current: data["app_version"] ?? "Unknown",
-          latest: data["openeo_latest_version"] ?? null,
-          lastCheck: data["openeo_last_version_check"] ?? null,
-          os_version: data["os_version"] ?? null,
-        });
-      })
-      .catch((err) => console.log("Error fetching version info:", err));
+  const updateVersionInfo = (data) => {
+    setVersionInfo({
+      current: data["app_version"] ?? "Unknown",
+      latest: data["openeo_latest_version"] ?? null,
+      lastCheck: data["openeo_last_version_check"] ?? null,
+      os_version: data["os_version"] ?? null,
+    });
   };
 
   const refreshStatus = () => {
@@ -86,9 +82,11 @@ export default function Update({ status = {} }) {
   };
 
   useEffect(() => {
-    fetchVersionInfo();
+    const unsubscribe = subscribeStatus(updateVersionInfo,
+      (err) => console.log("Error fetching version info:", err));
     refreshStatus();
     return () => {
+      unsubscribe();
       if (timerRef.current) clearInterval(timerRef.current);
     };
   }, []);
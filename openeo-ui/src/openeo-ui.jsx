@@ -6,6 +6,7 @@ import SolarTimer from "./Carousel/openeo-SolarTimer";
 import EVChargerStatus from "./Carousel/openeo-Status";
 import { useToastContext } from "./openeo-Toast";
 import { buildUrl } from './utils/funcs';
+import { subscribeStatus } from './utils/status';
 import { uiCss,globalCss,styles } from './utils/styles';
 
 
@@ -48,38 +49,23 @@ export default function ScheduleCarousel() {
 
 
   useEffect(() => {
-    let cancelled = false;
-
-    const fetchStatus = async () => {
-      try {
-        const res = await fetch(buildUrl("getstatus")); // your URL
-        if (!res.ok) throw new Error(`HTTP ${res.status}`);
-        const data = await res.json();
-
-        if (!cancelled) {
-          setStatus(data);
-          setError(null);
-        }
-      } catch (err) {
-        if (!cancelled) setError(err.message);
-      }
-    };
-
-    // Initial fetch
-    fetchStatus();
-
+    // Status is streamed from the backend, falling back to polling every pollinterval
     let pollinterval=1000 // 1 second
     if (typeof(statusUpdateInterval)!='undefined') {
       pollinterval=statusUpdateInterval
     }
-    console.log("Status Update interval",pollinterval);
-    const intervalId = setInterval(fetchStatus, pollinterval);
+
+    const unsubscribe = subscribeStatus(
+      (data) => {
+        setStatus(data);
+        setError(null);
+      },
+      (err) => setError(err.message),
+      pollinterval
+    );
 
     // Cleanup on unmount
-    return () => {
-      cancelled = true;
-      clearInterval(intervalId);
-    };
+    return unsubscribe;
   }, []);
 
   useEffect(() => {
@@ -1,4 +1,5 @@
 import React, { useEffect, useRef } from "react";
+import { chartUrl,columnarToPlotly } from './utils/charts';
 
 export default function ChartCDN() {
   const chartRef = useRef(null);
@@ -6,8 +7,9 @@ export default function ChartCDN() {
   const chartDataRef = useRef([]);
   const plotlyRef = useRef(null);
 
-  const url =
-    "getchartdata?type=plotly&series=eo_charger_state_id,eo_amps_requested_solar:eo_amps_requested_grid:eo_amps_requested_site_limit:eo_amps_requested:eo_amps_delivered,eo_current_vehicle:eo_current_site:eo_current_solar";
+  const series =
+    "eo_charger_state_id,eo_amps_requested_solar:eo_amps_requested_grid:eo_amps_requested_site_limit:eo_amps_requested:eo_amps_delivered,eo_current_vehicle:eo_current_site:eo_current_solar";
+  const url = chartUrl(series);
 
   const layout = {
     grid: { rows: 3, columns: 1, pattern: "independent" },
@@ -88,6 +90,7 @@ export default function ChartCDN() {
 
     fetch(url + "&since=" + maxTime)
       .then((r) => r.json())
+      .then((data) => columnarToPlotly(data, series))
       .then((data) => {
         data.forEach((series, i) => {
           chartData[i].x.push(...series.x);
@@ -121,6 +124,7 @@ export default function ChartCDN() {
       // Initial fetch & render
       fetch(url)
         .then((r) => r.json())
+        .then((data) => columnarToPlotly(data, series))
         .then((data) => {
           processData(data);
           chartDataRef.current = data;
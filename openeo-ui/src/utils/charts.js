@@ -0,0 +1,62 @@
+export function chartUrl(series) {
+  // URL for the chart data of a series spec, in the same format as for type=plotly
+  // (series separated by commas, and subplots by colons)
+  return `getchartdata?type=columnar&series=${series}`;
+}
+
+export function formatChartTime(ms) {
+  // Formats a time in milliseconds since the epoch as the backend does for type=plotly
+  // (local time, "YYYY-MM-DD HH:MM:SS.ffffff"), which is also the format it expects for since=
+  const d = new Date(ms);
+  const pad = (n, width = 2) => String(n).padStart(width, "0");
+  return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())} ` +
+    `${pad(d.getHours())}:${pad(d.getMinutes())}:${pad(d.getSeconds())}.${pad(d.getMilliseconds(), 3)}000`;
+}
+
+export function columnarToPlotly(data, series) {
+  // Expands a type=columnar response into the Plotly traces that type=plotly would have
+  // returned for the same series spec, so the charts only transfer the time axis once.
+  let time = data.start;
+  const x = data.delta.map((delta) => formatChartTime((time += delta)));
+
+  // As with type=plotly, subplots are only used if at least one has a colon separator
+  const subplots = series ? series.split(",") : [Object.keys(data.series).join(",")];
+  const usingSubplots = subplots.some((subplot) => subplot.includes(":"));
+  const groups = usingSubplots
+    ? subplots.map((subplot) => subplot.split(":"))
+    : [subplots.flatMap((subplot) => subplot.split(","))];
+
+  const traces = [];
+  groups.forEach((keys, i) => {
+    const index = usingSubplots ? i + 1 : null;
+    [...new Set(keys)].forEach((key) => {
+      if (!(key in data.series)) return;
+      const y = data.series[key];
+      const trace = {
+        type: "line",
+        mode: "lines",
+        name: data.names[key],
+        key: key,
+        stackgroup: null,
+        x: x.slice(),   // each trace is extended separately on update
+        y: y,
+        legend: index === null ? "legend1" : `legend${index}`,
+        legendgroup: index === null ? "1" : `${index}`,
+        xaxis: index === null ? "x" : `x${index}`,
+        yaxis: index === null ? "y" : `y${index}`,
+      };
+
+      const labels = data.labels?.[key];
+      if (labels) {
+        // Annotate the chart each time the state changes
+        trace.line = { shape: "hv" };
+        trace.mode = "lines+text";
+        trace.textposition = "top right";
+        trace.text = y.map((value, j) =>
+          j > 0 && value === y[j - 1] ? null : (labels[value] ?? null));
+      }
+      traces.push(trace);
+    });
+  });
+  return traces;
+}
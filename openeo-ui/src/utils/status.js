@@ -0,0 +1,63 @@
+import { buildUrl } from './funcs';
+
+export function subscribeStatus(onStatus, onError, pollinterval = 1000) {
+  // Calls onStatus with the charger status each time it changes. The status is streamed from
+  // getstatus/stream (a "state" event with every value, then a "delta" event holding whatever
+  // changed each cycle). If the browser or the backend doesn't support that, getstatus is polled
+  // every pollinterval ms instead. Returns a function that stops the updates.
+  let status = {};
+  let source = null;
+  let intervalId = null;
+  let stopped = false;
+
+  const fetchStatus = async () => {
+    try {
+      const res = await fetch(buildUrl("getstatus"));
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      const data = await res.json();
+      if (!stopped) onStatus(data);
+    } catch (err) {
+      if (!stopped) onError(err);
+    }
+  };
+
+  const poll = () => {
+    console.log("Status Update interval", pollinterval);
+    fetchStatus();
+    intervalId = setInterval(fetchStatus, pollinterval);
+  };
+
+  if (typeof EventSource === "undefined") {
+    poll();
+  } else {
+    let received = false;
+    source = new EventSource(buildUrl("getstatus/stream"));
+    source.addEventListener("state", (e) => {
+      received = true;
+      status = JSON.parse(e.data);
+      onStatus({ ...status });
+    });
+    source.addEventListener("delta", (e) => {
+      received = true;
+      Object.assign(status, JSON.parse(e.data));
+      onStatus({ ...status });
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself after a dropped connection, but if the stream
+      // never worked (or was refused) go back to polling
+      if (!received || source.readyState === EventSource.CLOSED) {
+        source.close();
+        source = null;
+        if (!stopped && intervalId === null) poll();
+      } else {
+        onError(new Error("Status stream disconnected"));
+      }
+    };
+  }
+
+  return () => {
+    stopped = true;
+    if (source) source.close();
+    if (intervalId !== null) clearInterval(intervalId);
+  };
+}
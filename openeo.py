@@ -22,19 +22,30 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import logging,numbers,copy,statistics
+import logging,numbers,statistics
 import logging.handlers
 import time, math, datetime
 import importlib
 import psutil
-import sys
+import sys, os, signal
 
 import globalState, util
 from openeoCharger import openeoChargerClass
+from EO_comms.Simulator import Simulator
+from openeoLoopTimer import openeoLoopTimerClass
 
 # logging for use in this module
 _LOGGER = logging.getLogger(__name__)
 
+# Delay (in seconds) before modules that poll less often than every loop are first polled
+STARTUP_DELAY = 50
+
+# Period (in seconds) over which the requested charging rate is smoothed
+SMOOTHING_PERIOD = 45
+
+LOOP_DURATION_SECONDS = globalState.metrics.histogram("sys_loop_duration_seconds",
+                    "Time taken by the main loop body, in seconds",buckets=(0.05,0.1,0.25,0.5,1,2,3,4,5,7.5,10,20))
+
 # Main Program
 
 def main():    
@@ -44,34 +55,53 @@ def main():
 
     globalState.configDB.logwrite(f"+++++ startup:{globalState.stateDict['app_version']} directory:{globalState.stateDict['app_deploy_directory']}")
 
-    # Make a snapshot of the stateDict for the configserver module to refer to
-    globalState.stateSnapshot=copy.copy(globalState.stateDict)
+    # Publish the initial state for the configserver module to refer to
+    globalState.stateStore.publish(globalState.stateDict)
 
-    # Main loop. It looks a bit odd setting this to a negative number, but this will
-    # have the effect of delaying the first run of any modules set with a pollfrequency
+    # Main loop. Each iteration is started on a fixed deadline by the loop timer, and the loop
+    # counter is derived from the timer tick, so it reflects elapsed time even if we overrun.
+    # It looks a bit odd starting this at a negative number, but this will have the effect
+    # of delaying the first run of any modules set with a pollinterval longer than the loop
     # this is to help reduce startup race conditions that might occur with networking
     # perhaps not fully started up when openeo begins
-    loop = -10
+    timer = openeoLoopTimerClass(globalState.LOOP_INTERVAL)
+    startup_ticks = timer.ticks_for(STARTUP_DELAY)
+    loop = timer.tick - startup_ticks
     globalState.stateDict["_moduleDict"]={}
 
     # For keeping track of the moving average of requested charging rate
-    smooth_requested_amps=[0]*9
+    smooth_requested_amps=[0]*timer.ticks_for(SMOOTHING_PERIOD)
 
     # Force the switch module to be enabled. Previous versions would 
     # Switch between enabled and disabled, so we force ourselves to a known
     # state. There's no reason now for it to be disabled.
     globalState.configDB.set("switch","enabled",True)
 
+    # Configuration generation that the loaded modules reflect. Each module also records the
+    # version of its own configuration that it was last configured with, so that only modules
+    # whose configuration has actually changed are reconfigured
+    config_generation = None
+
     while True:
         _LOGGER.debug("-- START LOOP --")
 
-        if globalState.configDB.changed:
+        if globalState.configDB.generation != config_generation:
             _LOGGER.info("Configuration flagged as changed")
-            # Reset the changed flag
-            globalState.configDB.changed=False
-            for modulename, pluginConfig in globalState.configDB.dict().items():
+            config_generation = globalState.configDB.generation
+            for modulename in globalState.configDB.dict():
+                # Read the version before the config, so that if it changes in between, we'll
+                # pick it up again next time round
+                config_version = globalState.configDB.version(modulename)
+                pluginConfig = globalState.configDB.get(modulename)
+                if pluginConfig is None:
+                    continue
+
                 # Modue should be enabled
                 if modulename in globalState.stateDict["_moduleDict"]:
+                    if globalState.stateDict["_moduleDict"][modulename].config_version == config_version:
+                        # Nothing has changed for this module
+                        continue
+
                     # Module already loaded, so just configure it
                     # Sanitize sensitive config for logging
                     safe_config = pluginConfig.copy()
@@ -81,7 +111,9 @@ def main():
                         if "mqtt_username" in safe_config:
                             safe_config["mqtt_username"] = "***"
                     _LOGGER.info("Configuring %s with %s", modulename, safe_config)
-                    globalState.stateDict["_moduleDict"][modulename].configure(pluginConfig)
+                    with globalState.pluginTiming.measure(modulename,"configure"):
+                        globalState.stateDict["_moduleDict"][modulename].configure(pluginConfig)
+                    globalState.stateDict["_moduleDict"][modulename].config_version = config_version
                 else:
                     _LOGGER.info("openeo initialising %s",modulename)
 
@@ -89,7 +121,9 @@ def main():
                         # module is in configfile, but not running - we need to instantiate it
                         moduleClass=getattr(importlib.import_module("lib."+modulename),modulename+"ClassPlugin")
                         # instantiate an object, configure it, and add to the list of active modules
-                        mod = moduleClass(pluginConfig)
+                        with globalState.pluginTiming.measure(modulename,"configure"):
+                            mod = moduleClass(pluginConfig)
+                        mod.config_version = config_version
                         globalState.stateDict["_moduleDict"][modulename] = mod
                     except ImportError as e:
                         _LOGGER.error("Aborting - Module '%s' defined and enabled in config file but could not be imported - %s" % (modulename, repr(e)))
@@ -105,7 +139,7 @@ def main():
             # Do we have any modules that are currently loaded, but not in the configfile
             # file (for example, perhaps the config file has been updated to remove one)
             for modulename,module in globalState.stateDict["_moduleDict"].copy().items():
-                if not modulename in globalState.configDB.dict().keys():
+                if not globalState.configDB.exists(modulename):
                     # module has recently been disabled in configfile, so unload
                     _LOGGER.info("Unloading %s",modulename)
                     del globalState.stateDict["_moduleDict"][modulename]
@@ -120,12 +154,19 @@ def main():
         
 
         for module_name, module in globalState.stateDict["_moduleDict"].items():
+            # Apply the results of any background poll that has completed since the last loop
+            module.apply_state()
             if module.get_config().get("enabled", True):
-                if module.pollfrequency>0 and (loop % module.pollfrequency) == 0:
+                poll_ticks=timer.ticks_for(module.pollinterval)
+                if module.next_poll_tick is None:
+                    # First due on the next multiple of the poll interval
+                    module.next_poll_tick=-(-loop//poll_ticks)*poll_ticks
+                if module.pollinterval>0 and loop>=module.next_poll_tick:
+                    module.next_poll_tick=(loop//poll_ticks+1)*poll_ticks
                     if callable(getattr(module,"poll",None)):
                         # Get the current from a module, whilst ensuring that it's an integer,
                         # and also between 0>=x>=32
-                        module_current = max(min(int(module.poll()),32),0)
+                        module_current = max(min(int(module.run_poll()),32),0)
 
                         # This check is entirely aesthetic - it's not required for correct behaviour of the charger
                         # but including it will ensure that the charts on the statistics page reflect what the charger
@@ -181,8 +222,8 @@ def main():
         ###############
         # Load smoothing
         # For rapidly changing eo_amps_requested (which might be generated by solar or load balancing),
-        # we will generate a moving average over 45 seconds (9 cycles). This is intended to avoid rapidly cycling
-        # values.
+        # we will generate a moving average over SMOOTHING_PERIOD seconds (45 seconds, or 9 cycles). This is
+        # intended to avoid rapidly cycling values.
 
         smooth_requested_amps.append(globalState.stateDict["eo_amps_requested"])
         del smooth_requested_amps[0]
@@ -199,7 +240,7 @@ def main():
             globalState.configDB.logwrite(f"site_ct={globalState.stateDict['eo_current_site']} vehicle_ct={globalState.stateDict['eo_current_vehicle']} solar_ct={globalState.stateDict['eo_current_solar']}")
             globalState.configDB.logwrite(f"sending amp limit={moving_average}")
             result = charger.set_amp_limit(moving_average)
-        except:
+        except Exception:
             _LOGGER.error("Problem getting result from serial command: ("+str(result)+")")
             result = None
 
@@ -213,15 +254,15 @@ def main():
             # Apply a default correction factor of ~0.77 to get correct-ish value. 
             globalState.stateDict["eo_live_voltage"] = round(
                 (
-                int(charger.live_voltage, 16)
+                charger.status.live_voltage
                 / 2
                 / math.sqrt(2)
                 * (float(globalState.configDB.get("chargeroptions","mains_voltage_correction", 77.6))/100)
                 ),
                 2,
             )
-            globalState.stateDict["eo_firmware_version"] = int(charger.version, 16)
-            globalState.stateDict["eo_current_switch_setting"] = int(charger.current_switch_setting, 16)
+            globalState.stateDict["eo_firmware_version"] = charger.status.version
+            globalState.stateDict["eo_current_switch_setting"] = charger.status.current_switch_setting
             globalState.stateDict["eo_current_site"] = charger.current_site
             globalState.stateDict["eo_current_vehicle"] = charger.current_vehicle
             globalState.stateDict["eo_current_solar"] = charger.current_solar
@@ -229,8 +270,8 @@ def main():
             globalState.stateDict["eo_current_raw_vehicle"] = charger.current_raw_vehicle
             globalState.stateDict["eo_current_raw_solar"] = charger.current_raw_solar
             globalState.stateDict["eo_power_delivered"] = round((globalState.stateDict["eo_live_voltage"] * globalState.stateDict["eo_current_vehicle"]) / 1000, 2)        # P=VA
-            globalState.stateDict["eo_mains_frequency"] = int(charger.mains_frequency, 16)
-            globalState.stateDict["eo_charger_state_id"] = int(charger.charger_state, 16)
+            globalState.stateDict["eo_mains_frequency"] = charger.status.mains_frequency
+            globalState.stateDict["eo_charger_state_id"] = charger.status.charger_state
             globalState.stateDict["eo_charger_state"] = openeoChargerClass.CHARGER_STATES[globalState.stateDict["eo_charger_state_id"]]
 
             globalState.stateDict["eo_amps_requested_solar"] = min(globalState.stateDict["eo_current_solar"], globalState.stateDict["eo_amps_requested"])
@@ -251,36 +292,45 @@ def main():
             if "logger" in globalState.stateDict["_moduleDict"]:
                 globalState.stateDict["_moduleDict"]["logger"].late_poll()
 
-            # And make a snapshot of the stateDict for the configserver module to refer to
-            globalState.stateSnapshot=copy.copy(globalState.stateDict)
-
         else:
             _LOGGER.debug("Ignoring State Update, we probably had a serial overrun")
 
-        # Housekeeping actions
-        if (loop % 12) == 0:
-            # Once a minute, purge the log table
-            globalState.configDB.logpurge()
         #########
         # System Metrics
         globalState.stateDict["sys_available_memory"]=psutil.virtual_memory().available/1024/1024
         globalState.stateDict["sys_free_memory"]=psutil.virtual_memory().free/1024/1024
         globalState.stateDict["sys_1m_load_average"]=psutil.getloadavg()[1]
+        globalState.stateDict["sys_log_queue_depth"]=globalState.configDB.log_queue.qsize()
+        globalState.stateDict["sys_log_dropped"]=globalState.configDB.log_dropped
         
         globalState.stateDict["eo_connected_to_controller"] = charger.connected
+        # Set by the hardware I/O thread, which doesn't write to stateDict itself
+        globalState.stateDict["eo_serial_number"] = charger.my_address
+        globalState.stateDict["eo_serial_errors"] = charger.rs485.serial_errors
+
+        # Main loop timing statistics (these refer to the previous loop)
+        globalState.stateDict.update(timer.stats())
+        globalState.stateDict["sys_plugin_timing"] = globalState.pluginTiming.summary()
+        globalState.stateDict["sys_slow_plugins"] = globalState.pluginTiming.slow_plugins()
+        globalState.stateDict["sys_slow_plugin_count"] = len(globalState.stateDict["sys_slow_plugins"])
+
+        # Publish any changes to the state, for the configserver module and streaming clients to refer to
+        globalState.stateStore.publish(globalState.stateDict)
         
         # Notify submodules about new state.  Not all modules want to hear about state changes.
         # @TODO: actually -track- changes and only generate an event when something relevant changes
-        for module,modulename in globalState.stateDict["_moduleDict"].items():
+        for modulename,module in globalState.stateDict["_moduleDict"].items():
             try:
                 getattr(module, "sync_state")
             except AttributeError:
                 pass
             else:
-                module.sync_state(globalState.stateDict)
+                with globalState.pluginTiming.measure(modulename,"sync_state"):
+                    module.sync_state(globalState.stateDict)
 
-        time.sleep(5)
-        loop += 1
+        # Wait for the next deadline
+        loop = timer.wait() - startup_ticks
+        LOOP_DURATION_SECONDS.observe(timer.last_duration)
 
 #################################################################################
 # Initialisation
@@ -301,13 +351,22 @@ if __name__ == "__main__":
         )
     )
 
-    logging.basicConfig(level=logging.INFO, handlers=[syslog_handler])
+    # There's no syslog when running on a development machine or CI (e.g. with the simulator)
+    logging.basicConfig(level=logging.INFO, handlers=[syslog_handler if os.path.exists("/dev/log") else console_handler])
 
     # logging for use in this module
     _LOGGER = logging.getLogger(__name__)
+
+    # systemd stops us with SIGTERM. Exit normally, so that the exit handlers run (e.g. flushing
+    # the log queue to the database)
+    def shutdown(signum, frame):
+        _LOGGER.info("Received SIGTERM, exiting")
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
     
-    _LOGGER.info("Setting bind capability for python")
-    util.ensure_net_bind_capability()
+    if not Simulator.identify_hardware():
+        _LOGGER.info("Setting bind capability for python")
+        util.ensure_net_bind_capability()
 
     _LOGGER.info("Starting openeo main loop")
     main()  # Run the main program
@@ -7,15 +7,51 @@ the serial number of the EO controller board and setting the maximum charging ra
 
 """
 #################################################################################
-import logging,time,math
-import RPi.GPIO as GPIO
-from EO_comms.HomeHub import HomeHub
-from EO_comms.MiniPro2 import MiniPro2
+import logging,time,math,threading
+from EO_comms.Simulator import Simulator
+from EO_comms.StatusFrame import StatusFrame
 import globalState
 
 # logging for use in this module
 _LOGGER = logging.getLogger(__name__)
 
+# Metrics for the controller comms, exported on /metrics
+SERIAL_COMMAND_SECONDS = globalState.metrics.histogram("eo_serial_command_seconds",
+                    "Round trip time of serial commands to the controller, in seconds",("command",))
+SERIAL_RX_SECONDS = globalState.metrics.histogram("eo_serial_rx_seconds",
+                    "Time spent waiting for the response to a serial command, in seconds")
+SERIAL_COMMANDS = globalState.metrics.counter("eo_serial_commands_total",
+                    "Serial commands sent to the controller, by result",("command","result"))
+SERIAL_RETRIES = globalState.metrics.counter("eo_serial_retries_total",
+                    "Serial commands that were retried after failing")
+CT_READ_SECONDS = globalState.metrics.histogram("eo_ct_read_seconds",
+                    "Time taken to read the CT sensors, in seconds")
+IO_ERRORS = globalState.metrics.counter("eo_io_errors_total",
+                    "Unexpected errors in the hardware I/O thread")
+
+#################################################################################
+class latestValueClass:
+    """
+    The latest value written by one thread, for other threads to read without locking or
+    waiting. The value and the time it was written are replaced together, as a single tuple,
+    so a reader always sees a consistent pair.
+    """
+
+    def __init__(self):
+        self.sample=(None,None)
+
+    def put(self,value):
+        self.sample=(time.monotonic(),value)
+
+    def get(self,max_age=None):
+        """
+        Returns the latest value, or None if there isn't one, or it is older than max_age seconds
+        """
+        timestamp,value=self.sample
+        if value is None or (max_age is not None and time.monotonic()-timestamp>max_age):
+            return None
+        return value
+
 #################################################################################
 class openeoChargerClass:
 
@@ -26,6 +62,12 @@ class openeoChargerClass:
     # Set if we're connected
     connected = False
 
+    # The most recent status reported by the controller (a StatusFrame)
+    status = None
+
+    # Samples from the hardware I/O thread older than this many of their intervals are stale
+    STALE_INTERVALS = 3
+
     #################################################################################
     # Reference Data
 
@@ -70,39 +112,48 @@ class openeoChargerClass:
         checksum2 = int(self.generateChecksum(text[:-3]), 16)
         return checksum1 == checksum2
 
-    def sendSerialCommand(self, packet = ""):
+    def sendSerialCommand(self, packet = "", decoder = None):
         """
         Sends a serial command to the contoller, adding a checksum. Recieves response,
-        checks the checksum, then strips the checksum off and returns the result
+        checks the checksum, then strips the checksum off and returns the result. If a
+        decoder is given (e.g. StatusFrame.decode), the response is returned as decoded by
+        that instead.
         """
+        command=next((name for name,code in self.EO_COMMAND.items() if packet[1:2]==code),"other")
+        start=time.perf_counter()
+
         packet=packet+self.generateChecksum(packet)
         self.rs485.tx(packet)
-        response = self.rs485.rx(recv_delay=0.5)
+        with SERIAL_RX_SECONDS.time():
+            response = self.rs485.rx(recv_delay=0.5)
+
+        SERIAL_COMMAND_SECONDS.observe(time.perf_counter()-start,command=command)
         if not response:
             _LOGGER.info("Response from serial was empty - possible serial overrun")
+            SERIAL_COMMANDS.inc(command=command,result="empty")
             return None
+        if decoder is not None:
+            decoded=decoder(response)
+            if decoded is None:
+                _LOGGER.info("Response from serial was not valid")
+                SERIAL_COMMANDS.inc(command=command,result="invalid")
+            else:
+                SERIAL_COMMANDS.inc(command=command,result="ok")
+            return decoded
         try:
             response = response.decode("ascii")
         except UnicodeDecodeError:
             _LOGGER.error("Could not decode serial response")
+            SERIAL_COMMANDS.inc(command=command,result="decode_error")
             return None
+        SERIAL_COMMANDS.inc(command=command,result="ok")
         return response[1:-3]
 
-    def set_amp_limit(self, requested_limit):
+    def send_amp_limit(self, requested_limit):
         """
-        Set the amp limit by sending the appropriate PWM value to the controller
+        Send the amp limit to the controller, as the appropriate PWM value. Returns the
+        status in the response (a StatusFrame), or None.
         """
-        if self.my_address == None:
-            #  If the address is stil None, try again to talk to the main board
-            self.connect()
-            if self.my_address == None:
-                _LOGGER.error("No comms with main board, cannot change current limit!")
-                return
-
-        if (not isinstance(requested_limit,(int)) or (requested_limit>32) or (requested_limit<0)):
-            _LOGGER.warning("Requested Amp Limit out of bounds (0>=x>=32): %d" % requested_limit)
-            return None
-
         # Calcualte duty cycle
         duty=0
         if requested_limit>=6:
@@ -110,55 +161,50 @@ class openeoChargerClass:
 
         # Construct and send instruction packet.  Duty cycle must be uppercase.
         packet="+"+self.EO_COMMAND["SET_LIMIT"]+self.my_address+f'{duty:03X}'
-        result = self.sendSerialCommand(packet)
+        status = self.sendSerialCommand(packet,StatusFrame.decode)
 
-        if result is None: #and self.using_spi:
+        if status is None: #and self.using_spi:
             # try again
-            result = self.sendSerialCommand(packet)
-
-        if result is not None:
-            # Perhaps stupidly, we've already stripped off the prefix, which puts the positions
-            # for slicing the result string out by one, so let's put that prefix back on..
-            result="!"+result
-            # More values in the response that we may wish to inspect in due course
-            self.version = result[1:3]
-            self.current_switch_setting = result[3]
-            self.control_pilot_voltage = result[4:7]
-            self.charge_duty = result[7:10]
-            self.plug_present_voltage = result[10:13]
-            self.live_voltage = result[13:16]
-            self.neutral_voltage = result[16:19]
-            self.daylight_detection = result[19:22]
-            self.mains_frequency = result[22:25]
-            self.charger_state = result[25:27]
-            self.relay_state = result[27]
-            self.plug_state = result[28]
-            self.HUB_duty_limit = result[29:32]
-            self.charge_duty_timer = result[32:36]
-            self.station_uptime = result[36:40]
-            self.charge_time = result[40:44]
-            self.state_of_mains = result[44:46]
-            self.cp_line_state = result[46]
-            self.station_ID = result[47]
-            self.random_value = result[48:50]
-            self.max_current = result[50:53]
-            self.persistant_ID = result[53:61]
-            self.watchdog_current = result[61:64]
-            self.watchdog_time = result[64:67]
-            self.p1_current = round(int(result[67:70], 16) / 10, 2)
-            self.p2_current = round(int(result[70:73], 16) / 10, 2)
-            self.p3_current = round(int(result[73:76], 16) / 10, 2)
-            self.eco_7_switch = result[76]
-            self.checksum = result[77:79]
-
-            ct=self.rs485.get_ct_readings()
+            SERIAL_RETRIES.inc()
+            status = self.sendSerialCommand(packet,StatusFrame.decode)
+
+        return status
+
+    def set_amp_limit(self, requested_limit):
+        """
+        Set the amp limit, which the I/O thread sends to the controller, and take the latest
+        status and CT readings that it has sampled. Doesn't wait for the hardware, so the
+        status may be from before this limit was applied. Returns True if there are recent
+        samples, otherwise None.
+        """
+        if (not isinstance(requested_limit,(int)) or (requested_limit>32) or (requested_limit<0)):
+            _LOGGER.warning("Requested Amp Limit out of bounds (0>=x>=32): %d" % requested_limit)
+            return None
+
+        # Requested again every loop, so that the I/O thread can tell if the main loop has stopped
+        previous_limit=self.limit_request.get()
+        self.limit_request.put(requested_limit)
+        if requested_limit!=previous_limit:
+            self.wakeup.set()
+
+        if self.my_address == None:
+            _LOGGER.error("No comms with main board, cannot change current limit!")
+            return None
+
+        status=self.status_sample.get(max_age=self.STALE_INTERVALS*globalState.LOOP_INTERVAL)
+        ct=self.ct_sample.get(max_age=self.STALE_INTERVALS*max(self.ct_sample_interval(),globalState.LOOP_INTERVAL))
+
+        if status is not None and ct is not None:
+            # The status reported by the controller, with every field decoded (see StatusFrame.FIELDS)
+            self.status = status
+
             self.current_site=ct["site"]
             self.current_vehicle=ct["vehicle"]
             self.current_solar=ct["solar"]
 
 
-            if MiniPro2.identify_hardware():
-                self.current_vehicle=self.p1_current
+            if self.rs485.VEHICLE_CURRENT_FROM_CONTROLLER:
+                self.current_vehicle=status.p1_current
 
             # CT Calibration
 
@@ -197,7 +243,8 @@ class openeoChargerClass:
                     seconds=(int(time.time()) % 180)*2
                     self.current_solar=int((simulate_ct_solar)*(1+math.sin(math.radians(seconds)))/2)
                     self.current_raw_solar=self.current_solar
-                    self.charger_state=hex(99) # Set charger state to 99, to indicate we're simulating values
+                    # Set charger state to 99, to indicate we're simulating values
+                    self.status=status._replace(charger_state=99)
                     self.current_vehicle=32
                     self.current_raw_vehicle=32
                     
@@ -212,20 +259,43 @@ class openeoChargerClass:
     def __init__(self):
 
         # Check hardware type, and initialise the correct object class for communications
-        # At this time there is only two hardware types that we are supporting, so this
-        # is easy, but extensible, if we find more.
+        # (see EO_comms.Transport). At this time there is only two hardware types that we are
+        # supporting, so this is easy, but extensible, if we find more.
         try:
-            if MiniPro2.identify_hardware():
-                self.rs485 = MiniPro2()
-            else:
-                self.rs485 = HomeHub()
+            self.rs485 = self.transport()()
         except Exception as e:
             _LOGGER.error(f"Error: Unable to initialise RS485 interface: {e}")
             print(f"Error: Unable to initialise RS485 interface: {e}\nIs OpenEO already running? Only one copy can run at any one time.")
             exit(1)
 
-        GPIO.setmode(GPIO.BCM)
         self.connect()
+        # Later reconnections are made from the I/O thread, so openeo.main() keeps this up to date
+        globalState.stateDict["eo_serial_number"]=self.my_address
+
+        # Latest samples from the hardware, written by the I/O thread
+        self.limit_request = latestValueClass()
+        self.status_sample = latestValueClass()
+        self.ct_sample = latestValueClass()
+        self.wakeup = threading.Event()
+        self.iothread = threading.Thread(target=self._iothread, name='iothread', daemon=True)
+        self.iothread.start()
+
+    @staticmethod
+    def transport():
+        """
+        Returns the transport class for the hardware that we're running on. The hardware
+        transports are only imported when needed, as they depend on the Pi's GPIO, SPI and
+        serial libraries, which the simulator doesn't need.
+        """
+        if Simulator.identify_hardware():
+            return Simulator
+
+        from EO_comms.MiniPro2 import MiniPro2
+        if MiniPro2.identify_hardware():
+            return MiniPro2
+
+        from EO_comms.HomeHub import HomeHub
+        return HomeHub
 
     def connect(self):
         """
@@ -237,7 +307,6 @@ class openeoChargerClass:
         
         self.my_address = self.sendSerialCommand("+"+ self.EO_COMMAND["DISCOVER"] +"5C")
         _LOGGER.debug("my_address set to '%s'" % str(self.my_address))
-        globalState.stateDict["eo_serial_number"]=self.my_address
 
         if self.my_address == None or len(self.my_address) == 0:
             _LOGGER.error("couldn't communicate with controller board")
@@ -246,3 +315,59 @@ class openeoChargerClass:
             self.connected = True
         
         return self.connected
+
+    #################################################################################
+    # Hardware I/O thread. All access to the controller and CTs is made from this thread,
+    # as on some hardware they share the serial line. The controller is sent the requested
+    # limit (and so its status is sampled) every loop interval, or as soon as the limit
+    # changes, and the CTs are read every ct_sample_interval. The main loop takes the latest
+    # samples from status_sample and ct_sample without waiting. If the main loop stops
+    # requesting a limit, the controller is sent a limit of 0 until it starts again, rather
+    # than being left charging at the last limit it asked for.
+
+    def ct_sample_interval(self):
+        """
+        Seconds between CT readings, which is the loop interval unless load management has
+        been configured with a ct_sample_interval to sample them more often
+        """
+        if "loadmanagement" in globalState.stateDict.get("_moduleDict",{}):
+            interval=globalState.stateDict["_moduleDict"]["loadmanagement"].pluginConfig.get("ct_sample_interval",0)
+            if interval>0:
+                return interval
+        return globalState.LOOP_INTERVAL
+
+    def _iothread(self):
+        _LOGGER.info("Starting hardware I/O thread")
+        limit_sent=None
+        next_status=next_ct=time.monotonic()
+
+        while True:
+            self.wakeup.clear()
+            try:
+                limit=self.limit_request.get()
+                if limit is not None and self.limit_request.get(max_age=self.STALE_INTERVALS*globalState.LOOP_INTERVAL) is None:
+                    if limit_sent!=0:
+                        _LOGGER.warning(f"No amp limit requested for {self.STALE_INTERVALS} loop intervals, setting it to 0")
+                    limit=0
+                if limit is not None and (time.monotonic()>=next_status or limit!=limit_sent):
+                    next_status=time.monotonic()+globalState.LOOP_INTERVAL
+                    if self.my_address == None:
+                        #  If the address is stil None, try again to talk to the main board
+                        self.connect()
+                    if self.my_address != None:
+                        status=self.send_amp_limit(limit)
+                        if status is not None:
+                            self.status_sample.put(status)
+                            limit_sent=limit
+
+                if time.monotonic()>=next_ct:
+                    next_ct=time.monotonic()+self.ct_sample_interval()
+                    with CT_READ_SECONDS.time():
+                        self.ct_sample.put(self.rs485.get_ct_readings())
+
+            except Exception as e:
+                _LOGGER.error(f"Error in hardware I/O thread: {e!r}")
+                IO_ERRORS.inc()
+                time.sleep(1)
+
+            self.wakeup.wait(max(0,min(next_status,next_ct)-time.monotonic()))
@@ -4,8 +4,8 @@ OpenEO Class for handling configuration get/set
 """
 #################################################################################
 
-import sqlite3,logging,json,os,time,re,numbers,datetime
-from threading import Lock
+import sqlite3,logging,json,os,time,re,numbers,datetime,queue,atexit
+from threading import Lock,Event,Thread
 from pwd import getpwnam
 from grp import getgrnam
 
@@ -14,7 +14,9 @@ _LOGGER = logging.getLogger(__name__)
 
 class openeoConfigClass:
 
-    CONFIG_DIR = "/home/pi/etc/"
+    # The configuration directory can be overridden for running away from the Pi (e.g. with the
+    # EO_comms simulator)
+    CONFIG_DIR = os.path.join(os.environ.get("OPENEO_CONFIG_DIR","/home/pi/etc"),"")
     DB_FILE = CONFIG_DIR+"config.db"
     JSON_FILE = CONFIG_DIR+"config.json"
     CONFIG_TABLE_1 = "configuration"
@@ -24,45 +26,207 @@ class openeoConfigClass:
     LOG_TABLE = "log"
     #LOG_PURGE_TTL = 3600 * 12 # 12 hours
 
+    # Log entries are queued in memory, and written to the database in batches by a background
+    # thread, either every LOG_FLUSH_INTERVAL seconds, or once LOG_FLUSH_RECORDS are waiting. If the
+    # queue fills up (LOG_QUEUE_SIZE), then further entries are dropped and counted in log_dropped
+    LOG_QUEUE_SIZE = 5000
+    LOG_FLUSH_INTERVAL = 10
+    LOG_FLUSH_RECORDS = 200
 
-    def logget(self):
+    # Number of rows read from the log table at a time by logquery(), the config lock is
+    # released between pages so that log retrieval doesn't hold up the main loop
+    LOG_PAGE_SIZE = 500
+
+    # Log retention is enforced by the log writer thread every LOG_PURGE_INTERVAL seconds. Old
+    # entries are deleted LOG_PURGE_CHUNK rows at a time, each chunk in its own short transaction,
+    # and then up to LOG_VACUUM_PAGES free pages are returned to the filesystem
+    LOG_PURGE_INTERVAL = 60
+    LOG_PURGE_CHUNK = 500
+    LOG_VACUUM_PAGES = 200
+
+
+    def logget(self,since=None,limit=None,filter=None):
         """
-        Retrieves the entire logfile
+        Retrieves the logfile (or the part of it matching the given criteria, see logquery())
+        as a string
         """
+        return "".join(self.logformat(row) for row in self.logquery(since=since,limit=limit,filter=filter))
 
-        rows=[]
-        with self.lock:
-            self.cursor.execute(f'''
-                SELECT * from {self.LOG_TABLE} 
-            ''')
-            rows = self.cursor.fetchall()
-        
-        string=""
-        for row in rows:
-            string+=f"{datetime.datetime.fromtimestamp(row[0])} {row[1]}\n"
+    def logformat(self,row):
+        """
+        Formats a row returned by logquery() as a line of text
+        """
+        return f"{datetime.datetime.fromtimestamp(row[1])} {row[2]}\n"
+
+    def logquery(self,since=None,after=None,limit=None,filter=None):
+        """
+        Generator returning (id, timestamp, message) tuples from the log, oldest first, read
+        a page at a time.
+        since:  only entries with a timestamp (unix epoch) at or after this time
+        after:  only entries with an id greater than this, i.e. the id of the last entry
+                previously seen can be used as a cursor to retrieve new entries
+        limit:  maximum number of entries to return
+        filter: only entries where the message contains this text
+        """
 
-        return string
+        # Make sure that anything still queued is included
+        self.logflush()
+
+        cursor=after if after is not None else 0
+        if since is not None:
+            # Use the timestamp index to find where to start, then page through by rowid
+            with self.lock:
+                row=self.conn.execute(f'''
+                    SELECT rowid FROM {self.LOG_TABLE} WHERE timestamp>=? ORDER BY timestamp LIMIT 1
+                ''', (int(since),)).fetchone()
+            if row is None:
+                return
+            cursor=max(cursor,row[0]-1)
+
+        sql=f"SELECT rowid, timestamp, message FROM {self.LOG_TABLE} WHERE rowid>?"
+        params=[]
+        if since is not None:
+            sql+=" AND timestamp>=?"
+            params.append(int(since))
+        if filter:
+            sql+=" AND instr(message,?)>0"
+            params.append(filter)
+        sql+=" ORDER BY rowid LIMIT ?"
+
+        remaining=limit
+        while remaining is None or remaining>0:
+            pagesize=self.LOG_PAGE_SIZE if remaining is None else min(self.LOG_PAGE_SIZE,remaining)
+            with self.lock:
+                rows=self.conn.execute(sql,(cursor,*params,pagesize)).fetchall()
+
+            yield from rows
+
+            if len(rows)<pagesize:
+                return
+            cursor=rows[-1][0]
+            if remaining is not None:
+                remaining-=len(rows)
 
     def logwrite(self,message):
         """
-        inserts an entry into a table called "log" in the sqlite database
+        queues an entry for the table called "log" in the sqlite database. Entries are written
+        in batches by the log writer thread (see logflush())
         """
-        with self.lock:
-            self.cursor.execute(f'''
-                INSERT INTO {self.LOG_TABLE} (timestamp, message) 
-                VALUES (?, ?)
-            ''', (int(time.time()), message))
-            self.conn.commit()
+        try:
+            self.log_queue.put_nowait((int(time.time()), message))
+        except queue.Full:
+            self.logdropped()
+            return
+
+        if self.log_queue.qsize()>=self.LOG_FLUSH_RECORDS:
+            self.log_event.set()
+
+    def logwritemany(self,messages):
+        """
+        queues a batch of entries for the log table, all with the same timestamp
+        """
+        timestamp=int(time.time())
+        for message in messages:
+            try:
+                self.log_queue.put_nowait((timestamp, message))
+            except queue.Full:
+                self.logdropped()
+
+        if self.log_queue.qsize()>=self.LOG_FLUSH_RECORDS:
+            self.log_event.set()
+
+    def logdropped(self):
+        """
+        Counts a log entry dropped because the queue was full. Entries are queued from several
+        threads, so the count is kept under its own lock
+        """
+        with self.log_dropped_lock:
+            self.log_dropped+=1
+
+    def logflush(self):
+        """
+        Writes all queued log entries to the database in a single transaction
+        """
+        with self.log_flush_lock:
+            rows=[]
+            try:
+                while True:
+                    rows.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if rows:
+                with self.lock:
+                    try:
+                        self.cursor.executemany(f'''
+                            INSERT INTO {self.LOG_TABLE} (timestamp, message) 
+                            VALUES (?, ?)
+                        ''', rows)
+                        self.conn.commit()
+                    except Exception:
+                        # Put the entries back, to be written next time (or counted as dropped
+                        # if there's no longer room for them)
+                        self.conn.rollback()
+                        for row in rows:
+                            try:
+                                self.log_queue.put_nowait(row)
+                            except queue.Full:
+                                self.logdropped()
+                        raise
+                self.log_written+=len(rows)
+
+    def _logwriter(self):
+        """
+        Background thread that periodically flushes the log queue, and purges old entries
+        """
+        next_purge=time.monotonic()+self.LOG_PURGE_INTERVAL
+        while True:
+            self.log_event.wait(self.LOG_FLUSH_INTERVAL)
+            self.log_event.clear()
+            try:
+                self.logflush()
+            except Exception as e:
+                _LOGGER.error(f"Error writing log entries: {e}")
+
+            if time.monotonic()>=next_purge:
+                next_purge=time.monotonic()+self.LOG_PURGE_INTERVAL
+                try:
+                    self.logpurge()
+                except Exception as e:
+                    _LOGGER.error(f"Error purging log entries: {e}")
 
     def logpurge(self):
         """
-        Purges log entries older than an hour ago
+        Purges log entries older than LOG_PURGE_TTL seconds. Returns the number of entries deleted
         """
+        # Entries are inserted in time order, so find the newest entry that has expired using
+        # the timestamp index, and then delete everything up to it by rowid, a chunk at a time
         with self.lock:
-            self.cursor.execute(f'''
-                DELETE FROM log where timestamp<? 
-            ''', (int(time.time()-self.LOG_PURGE_TTL),))
-            self.conn.commit()
+            row=self.conn.execute(f'''
+                SELECT rowid FROM {self.LOG_TABLE} WHERE timestamp<? ORDER BY timestamp DESC LIMIT 1
+            ''', (int(time.time()-self.LOG_PURGE_TTL),)).fetchone()
+        if row is None:
+            return 0
+
+        deleted=0
+        while True:
+            with self.lock:
+                result=self.conn.execute(f'''
+                    DELETE FROM {self.LOG_TABLE} WHERE rowid IN
+                        (SELECT rowid FROM {self.LOG_TABLE} WHERE rowid<=? ORDER BY rowid LIMIT ?)
+                ''', (row[0], self.LOG_PURGE_CHUNK))
+                self.conn.commit()
+            deleted+=result.rowcount
+            if result.rowcount<self.LOG_PURGE_CHUNK:
+                break
+
+        # Give free pages back to the filesystem, and reset the WAL so that neither the database
+        # nor the WAL file keeps growing
+        with self.lock:
+            self.conn.execute(f"PRAGMA incremental_vacuum({self.LOG_VACUUM_PAGES})").fetchall()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+        return deleted
 
 
     def exists(self, module):
@@ -71,8 +235,7 @@ class openeoConfigClass:
         Returns True if exists, False otherwise.
         """
         with self.lock:
-            self.cursor.execute(f"SELECT 1 FROM {self.CONFIG_TABLE} WHERE module=? LIMIT 1", (module,))
-            return self.cursor.fetchone() is not None
+            return module in self.cache
 
     def dict(self):
         """
@@ -80,33 +243,24 @@ class openeoConfigClass:
         {module: {key: value, key: value}}
         """
         with self.lock:
-            self.cursor.execute(f"SELECT module, key, value FROM {self.CONFIG_TABLE}")
-            rows = self.cursor.fetchall()
-
-        config_dict = {}
-        for module, key, value in rows:
-            if module not in config_dict:
-                config_dict[module] = {}
-            config_dict[module][key] = value
-        return config_dict
+            return {module: entries.copy() for module, entries in self.cache.items()}
     
     def get(self, module, key=None, default=None):
         """
         Given a module name, and optionally a key, retrieve all matching configuration
         if key is not specified, then the resultset will be returned as a Dict
         if key is specified, then only the value will be returned as a string, or 
-        default or None if no module/key combination is found
+        default or None if no module/key combination is found.
+        Reads are served from the in-memory cache of the configuration table.
         """
-        if key:
-            with self.lock:
-                self.cursor.execute(f"SELECT value FROM {self.CONFIG_TABLE} WHERE module=? AND key=?", (module, key))
-                row = self.cursor.fetchone()
-            return row[0] if row else default
-        else:
-            with self.lock:
-                self.cursor.execute(f"SELECT key, value FROM {self.CONFIG_TABLE} WHERE module=?", (module,))
-                rows = self.cursor.fetchall()
-            return {key: value for key, value in rows} if rows else None
+        with self.lock:
+            entries = self.cache.get(module)
+            if key:
+                return entries.get(key, default) if entries else default
+            else:
+                # Callers (e.g. PluginSuperClass.configure()) modify the dict they are given, so
+                # it must be a copy
+                return entries.copy() if entries else None
 
 
     def delete(self, module, key):
@@ -116,47 +270,104 @@ class openeoConfigClass:
         """
         with self.lock:
             self.cursor.execute(f"DELETE FROM {self.CONFIG_TABLE} WHERE module=? AND key=?", (module, key))
+            self.conn.commit()
+            if module in self.cache:
+                self.cache[module].pop(key, None)
+                if not self.cache[module]:
+                    del self.cache[module]
         return
 
         
 
+    def version(self, module):
+        """
+        Returns the change counter for a module. This is incremented whenever a set() that
+        triggers reconfiguration actually changes one of the module's values, so a plugin only
+        needs to be reconfigured if this differs from the version it was last configured with.
+        """
+        with self.lock:
+            return self.versions.get(module, 0)
+
     def set(self, module, key_or_dict, value=None, triggerModuleReonfigure=True):
         """
         Either:
         1. Set an individual configuration value, given the module and key; or
         2. Bulk set configuration for a module, given a dict containing key/value pairs
+        The database is written first, and then the in-memory cache is updated. Values that
+        are unchanged are not written. Returns the list of keys that were changed.
         """
-        if triggerModuleReonfigure:
-            # Flag that something may have changed, which will trigger all plugin modules to reload config
-            self.changed=True
+        if isinstance(key_or_dict, dict):
+            entries = key_or_dict
+        else:
+            entries = {key_or_dict: value}
 
-        with self.lock:
-            if isinstance(key_or_dict, dict):
-                # Bulk insert
-                for key, val in key_or_dict.items():
-                    self.cursor.execute(f'''
-                        REPLACE INTO {self.CONFIG_TABLE} (module, key, value, update_ts) 
-                        VALUES (?, ?, ?, unixepoch())
-                    ''', (module, key, val))
+        return self.set_many({module: entries}, triggerModuleReonfigure).get(module, [])
 
-            else:
-                # Single insert
-                key = key_or_dict
-                self.cursor.execute(f'''
-                    REPLACE INTO {self.CONFIG_TABLE} (module, key, value, update_ts) 
-                    VALUES (?, ?, ?, unixepoch())
-                ''', (module, key, value))
+    def set_many(self, config, triggerModuleReonfigure=True):
+        """
+        Set configuration for any number of modules, given a dict of dicts:
+        {module: {key: value, key: value}}
+        All changes are applied in a single transaction, and the audit log entries are queued
+        together. Returns a dict of {module: [keys that were changed]}
+        """
+        with self.lock:
+            changes = {}
+            for module, entries in config.items():
+                cached = self.cache.get(module, {})
+                changed = {key: val for key, val in entries.items()
+                           if key not in cached or cached[key] != self._dbvalue(val)}
+                if changed:
+                    changes[module] = changed
+
+            if not changes:
+                return {}
+
+            self.cursor.executemany(f'''
+                REPLACE INTO {self.CONFIG_TABLE} (module, key, value, update_ts) 
+                VALUES (?, ?, ?, unixepoch())
+            ''', [(module, key, val) for module, changed in changes.items() for key, val in changed.items()])
 
             self.conn.commit()
 
-        if isinstance(key_or_dict, dict):
-            for key, value in key_or_dict.items():
-                # Don't write any keys prefixed by underscore to the log
-                if key[0]!="_":
-                    self.logwrite(f"Config update {module}:{key}={value}")
-        else:
-            if key_or_dict[0]!="_":
-                self.logwrite(f"Config update {module}:{key_or_dict}={value}")
+            for module, changed in changes.items():
+                cached = self.cache.setdefault(module, {})
+                for key, val in changed.items():
+                    cached[key] = self._dbvalue(val)
+
+                if triggerModuleReonfigure:
+                    # Record that this module has changed, which will trigger the plugin module to
+                    # reload its config (see version() and generation)
+                    self.versions[module] = self.versions.get(module, 0) + 1
+
+            if triggerModuleReonfigure:
+                self.generation += 1
+
+        # Don't write any keys prefixed by underscore to the log
+        self.logwritemany([f"Config update {module}:{key}={value}"
+                           for module, changed in changes.items() for key, value in changed.items() if key[0]!="_"])
+
+        return {module: list(changed) for module, changed in changes.items()}
+
+    def _dbvalue(self, value):
+        """
+        Returns value as it would be read back from the database, so that the cache and the
+        database agree. sqlite stores bools as integers.
+        """
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def _loadcache(self):
+        """
+        Loads the whole configuration table into the in-memory cache
+        """
+        with self.lock:
+            self.cursor.execute(f"SELECT module, key, value FROM {self.CONFIG_TABLE}")
+            rows = self.cursor.fetchall()
+
+            self.cache = {}
+            for module, key, value in rows:
+                self.cache.setdefault(module, {})[key] = value
 
 
     def __init__(self,defaultConfig=None):
@@ -169,18 +380,37 @@ class openeoConfigClass:
         # if CONFIG_DIR doesn't exist, create it
         if not os.path.isdir(self.CONFIG_DIR):
             os.mkdir(self.CONFIG_DIR)
-            uid= getpwnam('pi')[2]
-            gid= getgrnam('pi')[2]
-            os.chown(self.CONFIG_DIR,uid,gid)
+            try:
+                uid= getpwnam('pi')[2]
+                gid= getgrnam('pi')[2]
+                os.chown(self.CONFIG_DIR,uid,gid)
+            except KeyError:
+                # No pi user, so we're not running on the Pi
+                pass
 
 
         # Create mutex lock for protecting transactions
         self.lock=Lock()
 
+        # Log queue, drained by the log writer thread which is started once the database is ready
+        self.log_queue=queue.Queue(maxsize=self.LOG_QUEUE_SIZE)
+        self.log_event=Event()
+        self.log_flush_lock=Lock()
+        self.log_dropped_lock=Lock()
+        self.log_dropped=0
+        self.log_written=0
+
         # Initialize SQLite DB and table
         self.conn = sqlite3.connect(self.DB_FILE, check_same_thread=False)
         self.conn.execute('pragma journal_mode=wal')
 
+        # Incremental vacuum lets logpurge() release free pages a few at a time. This can only be
+        # enabled on an existing database by rebuilding it, which is a one-off cost
+        self.conn.execute('pragma auto_vacuum=incremental')
+        if self.conn.execute('pragma auto_vacuum').fetchone()[0]!=2:
+            _LOGGER.info("Enabling incremental vacuum on configuration database")
+            self.conn.execute('vacuum')
+
         self.cursor = self.conn.cursor()
         self.cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS {self.CONFIG_TABLE_2} (
@@ -198,8 +428,17 @@ class openeoConfigClass:
                 message TEXT NOT NULL
             )
         ''')
+        self.cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {self.LOG_TABLE}_timestamp ON {self.LOG_TABLE} (timestamp)
+        ''')
         self.conn.commit()
 
+        # Start the log writer, and make sure that anything queued at exit is written (openeo.py
+        # turns SIGTERM into a normal exit, so that this also happens when stopped by systemd)
+        self.log_thread=Thread(target=self._logwriter, name='logwriter', daemon=True)
+        self.log_thread.start()
+        atexit.register(self.logflush)
+
         # schema v2 introduces a requirement for update timestamps to record config changes
         with self.lock:
             try:
@@ -224,6 +463,15 @@ class openeoConfigClass:
                 else:
                     print("Error migrating old data: ",err)
 
+        # Configuration is read from an in-memory copy of the table, which set() and delete()
+        # keep up to date
+        self._loadcache()
+
+        # Per module change counters (see version()), and a counter of all changes, so that
+        # the main loop can cheaply check whether anything needs reconfiguring
+        self.versions = {}
+        self.generation = 0
+
         #################
         # Set default config, where appropriate
         for module,entriesDict in defaultConfig.items():
@@ -251,8 +499,8 @@ class openeoConfigClass:
                 _LOGGER.error(f"Error loading initial config from '{self.JSON_FILE}': {e}")
 
 
-        # Set changed to True, so that configured modules will load in the main loop
-        self.changed=True
+        # Plugin modules are loaded in the main loop from whatever is configured at this point
+        self.generation += 1
         #print(str(self))
         self.LOG_PURGE_TTL=self.get("chargeroptions","log_purge_ttl",3600 * 24)
 
@@ -261,14 +509,10 @@ class openeoConfigClass:
         """
         dumps all configuration as a string for debugging purposes
         """
-        # Acquire mutex lock, and run SQL
-        with self.lock:
-            self.cursor.execute(f"SELECT module, key, value FROM {self.CONFIG_TABLE} ORDER BY module, key")
-            rows = self.cursor.fetchall()
-        
         output = ""
-        for module, key, value in rows:
-            output += f"[{module}] {key} = {value}\n"
+        for module, entries in sorted(self.dict().items()):
+            for key, value in sorted(entries.items()):
+                output += f"[{module}] {key} = {value}\n"
         return output.strip()
 
     def __del__(self):
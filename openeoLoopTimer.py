@@ -0,0 +1,98 @@
+#################################################################################
+"""
+OpenEO Class for pacing the main loop
+
+Rather than sleeping for a fixed period at the end of each loop (which means the real
+period drifts by however long the loop body took), each cycle is given a fixed deadline
+on the monotonic clock. If the loop body overruns one or more deadlines, the missed
+ticks are skipped rather than run back to back, so that the tick counter always reflects
+elapsed time, and overrun/jitter statistics are kept so that they can be reported.
+"""
+#################################################################################
+
+import time,logging
+from collections import deque
+
+# logging for use in this module
+_LOGGER = logging.getLogger(__name__)
+
+class openeoLoopTimerClass:
+
+    # Number of recent cycles used for the jitter/duration statistics
+    STATS_WINDOW = 120
+
+    def __init__(self,interval=5):
+        self.interval=interval
+
+        # tick is the index of the current deadline, counted from the start time. Missed
+        # deadlines still advance the tick, so tick*interval is (approximately) the
+        # elapsed time since the timer started
+        self.tick=0
+        self.start=time.monotonic()
+        self.deadline=self.start
+        self.cycle_start=self.start
+
+        self.cycles=0
+        self.overruns=0
+        self.skipped_ticks=0
+        self.last_duration=0
+        self.last_jitter=0
+        self.durations=deque(maxlen=self.STATS_WINDOW)
+        self.jitters=deque(maxlen=self.STATS_WINDOW)
+
+    def ticks_for(self,seconds):
+        """
+        Convert a period in seconds into a whole number of ticks (minimum of 1), so that
+        callers can work out whether something is due on the current tick
+        """
+        return max(1,round(seconds/self.interval))
+
+    def wait(self):
+        """
+        Sleep until the next deadline, and return the tick number that we woke up for.
+        Should be called once at the end of each loop iteration.
+        """
+        now=time.monotonic()
+        self.last_duration=now-self.cycle_start
+        self.durations.append(self.last_duration)
+        self.cycles+=1
+
+        next_tick=self.tick+1
+        next_deadline=self.start+(next_tick*self.interval)
+
+        if now>=next_deadline:
+            # We've overrun at least one deadline. Skip straight to the next deadline that
+            # is still in the future rather than trying to catch up
+            overrun=now-next_deadline
+            missed=int(overrun//self.interval)+1
+            self.overruns+=1
+            self.skipped_ticks+=missed
+            next_tick+=missed
+            next_deadline=self.start+(next_tick*self.interval)
+            _LOGGER.info(f"Main loop overran by {overrun:.3f}s ({self.last_duration:.3f}s cycle), skipping {missed} tick(s)")
+
+        time.sleep(max(0,next_deadline-time.monotonic()))
+
+        self.cycle_start=time.monotonic()
+        self.last_jitter=self.cycle_start-next_deadline
+        self.jitters.append(self.last_jitter)
+        self.tick=next_tick
+        self.deadline=next_deadline
+
+        return self.tick
+
+    def stats(self):
+        """
+        Return a dict of loop timing statistics, suitable for merging into the stateDict.
+        Times are reported in milliseconds
+        """
+        return {
+            "sys_loop_interval": self.interval,
+            "sys_loop_cycles": self.cycles,
+            "sys_loop_overruns": self.overruns,
+            "sys_loop_skipped_ticks": self.skipped_ticks,
+            "sys_loop_duration_ms": round(self.last_duration*1000,1),
+            "sys_loop_duration_max_ms": round(max(self.durations,default=0)*1000,1),
+            "sys_loop_jitter_ms": round(self.last_jitter*1000,1),
+            "sys_loop_jitter_max_ms": round(max(self.jitters,default=0)*1000,1),
+        }
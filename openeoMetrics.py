@@ -0,0 +1,384 @@
+#################################################################################
+"""
+OpenEO Classes for recording timing metrics
+
+Everything on the main loop runs serially, so a single slow plugin (e.g. a network call
+or subprocess) stalls charger control. These classes record how long each plugin takes
+in poll(), sync_state() and configure() into rolling windows, so that the distribution
+can be reported through /getstatus and /metrics, and flag plugins that exceed a budget.
+
+metricsRegistryClass holds counters and histograms for anything that happens more often
+than the state is sampled (e.g. serial round trips), and prometheusExpositionClass renders
+those, along with the state, for /metrics in the Prometheus text format.
+"""
+#################################################################################
+
+import time,logging,contextlib,numbers,gzip
+from collections import deque
+from threading import Lock
+
+# logging for use in this module
+_LOGGER = logging.getLogger(__name__)
+
+#################################################################################
+class rollingHistogramClass:
+    """
+    Keeps the most recent samples of a duration (in seconds), along with lifetime
+    count, total and maximum, and reports percentiles over the retained window
+    """
+
+    def __init__(self,size=500):
+        self.samples=deque(maxlen=size)
+        self.count=0
+        self.total=0.0
+        self.max=0.0
+        self.last=0.0
+
+    def observe(self,seconds):
+        self.samples.append(seconds)
+        self.count+=1
+        self.total+=seconds
+        self.max=max(self.max,seconds)
+        self.last=seconds
+
+    def percentiles(self,*qs):
+        # Nearest-rank percentiles over the retained samples, sorting them once
+        if not self.samples:
+            return [0.0]*len(qs)
+        ordered=sorted(self.samples)
+        return [ordered[min(len(ordered)-1,max(0,round(q*len(ordered))-1))] for q in qs]
+
+    def summary(self):
+        p50,p99=self.percentiles(0.5,0.99)
+        return {
+            "count": self.count,
+            "last_ms": round(self.last*1000,2),
+            "p50_ms": round(p50*1000,2),
+            "p99_ms": round(p99*1000,2),
+            "max_ms": round(self.max*1000,2),
+            "sum_ms": round(self.total*1000,2),
+        }
+
+#################################################################################
+class pluginTimingClass:
+    """
+    Per plugin, per phase (poll, sync_state, configure) timing. Use as:
+
+        with globalState.pluginTiming.measure("scheduler","poll"):
+            module.poll()
+    """
+
+    # Seconds for which summary() returns the same result. Summarising sorts every window,
+    # and the result is published in the state, so it isn't refreshed every loop
+    SUMMARY_INTERVAL = 60
+
+    def __init__(self,budget=1.0):
+        # Budget, in seconds, that a single plugin call is expected to complete within
+        self.budget=budget
+        self.histograms={}
+        self.over_budget={}
+        self.lock=Lock()
+        self.summarised=None
+        self.last_summary={}
+
+    @contextlib.contextmanager
+    def measure(self,module,phase):
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(module,phase,time.perf_counter()-start)
+
+    def observe(self,module,phase,seconds):
+        with self.lock:
+            if (module,phase) not in self.histograms:
+                self.histograms[(module,phase)]=rollingHistogramClass()
+            self.histograms[(module,phase)].observe(seconds)
+
+            if self.budget>0 and seconds>self.budget:
+                self.over_budget[module]=self.over_budget.get(module,0)+1
+                slow=True
+            else:
+                slow=False
+
+        if slow:
+            _LOGGER.warning(f"Plugin {module} took {seconds:.3f}s in {phase}(), exceeding budget of {self.budget:.3f}s")
+
+    def slow_plugins(self):
+        """
+        List of plugins that have exceeded the budget in the most recent call of any phase
+        """
+        with self.lock:
+            return sorted({module for (module,phase),histogram in self.histograms.items()
+                           if self.budget>0 and histogram.last>self.budget})
+
+    def summary(self):
+        """
+        Returns a dict of {module: {phase: {count, last_ms, p50_ms, p99_ms, max_ms, sum_ms}, "over_budget": n}},
+        refreshed at most every SUMMARY_INTERVAL seconds
+        """
+        now=time.monotonic()
+        if self.summarised is not None and now-self.summarised<self.SUMMARY_INTERVAL:
+            return self.last_summary
+
+        result={}
+        with self.lock:
+            for (module,phase),histogram in sorted(self.histograms.items()):
+                if module not in result:
+                    result[module]={"over_budget": self.over_budget.get(module,0)}
+                result[module][phase]=histogram.summary()
+        self.summarised=now
+        self.last_summary=result
+        return result
+
+#################################################################################
+class counterClass:
+    """
+    Prometheus style counter, optionally with labels. Use as:
+
+        SERIAL_COMMANDS=globalState.metrics.counter("eo_serial_commands_total","Serial commands sent",("result",))
+        SERIAL_COMMANDS.inc(result="ok")
+    """
+    type="counter"
+
+    def __init__(self,name,help,labelnames=()):
+        self.name=name
+        self.help=help
+        self.labelnames=tuple(labelnames)
+        self.values={}
+        self.lock=Lock()
+
+    def labelvalues(self,labels):
+        return tuple(str(labels.get(label,"")) for label in self.labelnames)
+
+    def inc(self,amount=1,**labels):
+        key=self.labelvalues(labels)
+        with self.lock:
+            self.values[key]=self.values.get(key,0)+amount
+
+    def get(self,**labels):
+        with self.lock:
+            return self.values.get(self.labelvalues(labels),0)
+
+    def format_labels(self,key,extra=""):
+        labels=[f'{label}="{prometheusExpositionClass.escape(value)}"' for label,value in zip(self.labelnames,key)]
+        if extra:
+            labels.append(extra)
+        return "{"+",".join(labels)+"}" if labels else ""
+
+    def render(self):
+        with self.lock:
+            values=sorted(self.values.items())
+        return [f"{self.name}{self.format_labels(key)} {value}" for key,value in values]
+
+#################################################################################
+class histogramClass(counterClass):
+    """
+    Prometheus style histogram, with cumulative buckets, optionally with labels. Use as:
+
+        with SERIAL_SECONDS.time(command="SET_LIMIT"):
+            ...
+    """
+    type="histogram"
+
+    # Default buckets, in seconds, suitable for serial and SPI exchanges
+    BUCKETS=(0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,0.75,1.0,2.5,5.0)
+
+    def __init__(self,name,help,labelnames=(),buckets=None):
+        super().__init__(name,help,labelnames)
+        self.buckets=tuple(sorted(buckets or self.BUCKETS))
+
+    def observe(self,value,**labels):
+        key=self.labelvalues(labels)
+        with self.lock:
+            if key not in self.values:
+                # one count per bucket, followed by the count and sum of all observations
+                self.values[key]=[0]*len(self.buckets)+[0,0.0]
+            counts=self.values[key]
+            for i,bound in enumerate(self.buckets):
+                if value<=bound:
+                    counts[i]+=1
+            counts[-2]+=1
+            counts[-1]+=value
+
+    @contextlib.contextmanager
+    def time(self,**labels):
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter()-start,**labels)
+
+    def get(self,**labels):
+        # Returns (count, sum) of observations
+        with self.lock:
+            counts=self.values.get(self.labelvalues(labels))
+            return (counts[-2],counts[-1]) if counts else (0,0.0)
+
+    def render(self):
+        with self.lock:
+            values=sorted((key,list(counts)) for key,counts in self.values.items())
+        lines=[]
+        for key,counts in values:
+            for bound,count in zip(self.buckets+("+Inf",),counts[:-2]+[counts[-2]]):
+                le=f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self.format_labels(key,le)} {count}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {counts[-2]}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {counts[-1]}")
+        return lines
+
+#################################################################################
+class metricsRegistryClass:
+    """
+    Registry of counters and histograms, exported on /metrics. Asking for a metric that is
+    already registered returns the existing one, so modules can declare their metrics at
+    import time, or wherever is convenient.
+    """
+
+    def __init__(self):
+        self.metrics={}
+        self.lock=Lock()
+
+    def _register(self,metricClass,name,*args,**kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name]=metricClass(name,*args,**kwargs)
+            return self.metrics[name]
+
+    def counter(self,name,help,labelnames=()):
+        return self._register(counterClass,name,help,labelnames)
+
+    def histogram(self,name,help,labelnames=(),buckets=None):
+        return self._register(histogramClass,name,help,labelnames,buckets)
+
+    def render(self):
+        with self.lock:
+            metrics=list(self.metrics.values())
+        lines=[]
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return lines
+
+#################################################################################
+class prometheusExpositionClass:
+    """
+    Renders the public state (from globalState.stateStore), followed by the metrics in the
+    registry, in the Prometheus text exposition format. The state only changes once per main
+    loop cycle, so the rendered text (and its gzip compression) is cached against the state
+    version, and each scrape is a single write of the cached bytes however often Prometheus
+    scrapes. The registry metrics are as of the last render.
+    """
+
+    # Descriptions for the HELP lines. Anything not listed here is described by its name.
+    HELP = {
+        "eo_amps_requested": "Current requested by the plugins, in amps",
+        "eo_amps_requested_grid": "Part of the requested current supplied from the grid, in amps",
+        "eo_amps_requested_solar": "Part of the requested current supplied from solar, in amps",
+        "eo_amps_requested_site_limit": "Current that could not be requested because of the site limit, in amps",
+        "eo_amps_requested_moving_average": "Moving average of the requested current, in amps",
+        "eo_amps_delivered": "Current delivered to the vehicle, in amps",
+        "eo_amps_limit": "Current limit sent to the charger, in amps",
+        "eo_charger_state_id": "Numeric charger state (see eo_charger_state_info for the name)",
+        "eo_connected_to_controller": "1 if the controller board is responding",
+        "eo_current_site": "Site import current (CT, calibrated), in amps",
+        "eo_current_vehicle": "Vehicle supply current (CT, calibrated), in amps",
+        "eo_current_solar": "Solar generation current (CT, calibrated), in amps",
+        "eo_current_raw_site": "Site import current (CT, uncalibrated), in amps",
+        "eo_current_raw_vehicle": "Vehicle supply current (CT, uncalibrated), in amps",
+        "eo_current_raw_solar": "Solar generation current (CT, uncalibrated), in amps",
+        "eo_live_voltage": "Mains voltage, in volts",
+        "eo_mains_frequency": "Mains frequency, in hertz",
+        "eo_power_delivered": "Power delivered to the vehicle, in kilowatts",
+        "eo_power_requested": "Power requested, in kilowatts",
+        "eo_serial_errors": "Number of failed serial exchanges with the controller",
+        "eo_session_kwh": "Energy delivered in the current session, in kilowatt hours",
+        "eo_session_cost": "Cost of the current session",
+        "eo_session_seconds_charged": "Time spent charging in the current session, in seconds",
+        "sys_cpu_temperature": "CPU temperature, in degrees celsius",
+        "sys_1m_load_average": "System load average",
+        "sys_available_memory": "Available memory, in megabytes",
+        "sys_free_memory": "Free memory, in megabytes",
+        "sys_wifi_strength": "WiFi signal strength, in percent",
+        "sys_log_queue_depth": "Number of log entries waiting to be written",
+        "sys_log_dropped": "Number of log entries dropped because the queue was full",
+        "sys_loop_cycles": "Number of main loop cycles",
+        "sys_loop_overruns": "Number of main loop cycles that overran the loop interval",
+        "sys_loop_skipped_ticks": "Number of main loop deadlines missed because of overruns",
+        "sys_loop_duration_ms": "Duration of the last main loop cycle, in milliseconds",
+        "sys_loop_jitter_ms": "Lateness of the last main loop cycle, in milliseconds",
+    }
+
+    # State values that only ever increase
+    COUNTERS = {"eo_serial_errors","sys_log_dropped","sys_loop_cycles","sys_loop_overruns","sys_loop_skipped_ticks"}
+
+    def __init__(self,registry=None):
+        self.registry=registry
+        self.version=None
+        self.text=b""
+        self.compressed=None
+        self.lock=Lock()
+
+    def get(self,store,compress=False):
+        """
+        Returns the exposition as bytes, optionally gzip compressed, rendering it if the
+        state has changed since it was last rendered
+        """
+        with self.lock:
+            if store.version!=self.version:
+                self.version,state=store.snapshot()
+                self.text=self.render(state).encode("utf-8")
+                self.compressed=None
+            if not compress:
+                return self.text
+            if self.compressed is None:
+                self.compressed=gzip.compress(self.text,compresslevel=5)
+            return self.compressed
+
+    def render(self,state):
+        lines=[]
+        for key,value in state.items():
+            # Convert any bool values to int, and then only show numerics
+            if isinstance(value,bool):
+                value=int(value)
+            if not isinstance(value,numbers.Number):
+                continue
+            lines.append(f"# HELP {key} {self.HELP.get(key,key)}")
+            lines.append(f"# TYPE {key} {'counter' if key in self.COUNTERS else 'gauge'}")
+            lines.append(f"{key} {value}")
+
+        if "eo_charger_state" in state:
+            lines.append("# HELP eo_charger_state_info Current charger state, as a label")
+            lines.append("# TYPE eo_charger_state_info gauge")
+            lines.append(f'eo_charger_state_info{{state="{self.escape(state["eo_charger_state"])}",id="{state.get("eo_charger_state_id","")}"}} 1')
+
+        # Plugin call timings, as a summary per plugin and phase
+        plugin_timing=state.get("sys_plugin_timing",{})
+        if plugin_timing:
+            lines.append("# HELP sys_plugin_duration_seconds Time taken by plugin poll/sync_state/configure calls")
+            lines.append("# TYPE sys_plugin_duration_seconds summary")
+            for plugin,phases in plugin_timing.items():
+                for phase,timing in phases.items():
+                    if not isinstance(timing,dict):
+                        continue
+                    labels=f'plugin="{plugin}",phase="{phase}"'
+                    lines.append(f'sys_plugin_duration_seconds{{{labels},quantile="0.5"}} {timing["p50_ms"]/1000}')
+                    lines.append(f'sys_plugin_duration_seconds{{{labels},quantile="0.99"}} {timing["p99_ms"]/1000}')
+                    lines.append(f'sys_plugin_duration_seconds_sum{{{labels}}} {timing["sum_ms"]/1000}')
+                    lines.append(f'sys_plugin_duration_seconds_count{{{labels}}} {timing["count"]}')
+
+            lines.append("# HELP sys_plugin_over_budget_total Number of plugin calls that exceeded the time budget")
+            lines.append("# TYPE sys_plugin_over_budget_total counter")
+            for plugin,phases in plugin_timing.items():
+                lines.append(f'sys_plugin_over_budget_total{{plugin="{plugin}"}} {phases["over_budget"]}')
+
+        if self.registry is not None:
+            lines.extend(self.registry.render())
+
+        return "\n".join(lines)+"\n"
+
+    @staticmethod
+    def escape(value):
+        # Escape a label value
+        return str(value).replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
@@ -0,0 +1,147 @@
+#################################################################################
+"""
+OpenEO Classes for publishing the running state
+
+The main loop publishes the public (not underscore prefixed) part of the stateDict once
+per cycle into a versioned store. Each value is serialised to JSON once, and compared with
+what was published previously. If anything has changed the store's version is incremented,
+and each changed key records the version it changed at, so that consumers can ask for just
+the changes since the version that they last saw, rather than copying and re-serialising the
+whole state (e.g. clients streaming the state through /getstatus/stream).
+"""
+#################################################################################
+
+import json,logging,time
+from threading import Condition
+
+# logging for use in this module
+_LOGGER = logging.getLogger(__name__)
+
+#################################################################################
+class stateStoreClass:
+    """
+    Versioned store of the public state. Use as:
+
+        version,changes=globalState.stateStore.changes_since(last_version)
+
+    Version numbers start from 1 each time openeo starts, so versions given to clients (see
+    tag()) are prefixed with an epoch that is different for each run. A version from another
+    run is treated as 0 (i.e. everything has changed).
+    """
+
+    def __init__(self):
+        self.version=0
+        # Identifies this run, so that versions from a previous one aren't mistaken for ours
+        self.epoch=str(time.time_ns())
+        self.values={}
+        # JSON encoding of each value, and the version at which each key last changed
+        self.encoded={}
+        self.changed={}
+        self.condition=Condition()
+        # The most recently built delta event, which every streaming client that is up to date will want
+        self.last_event=None
+
+    def publish(self,state):
+        """
+        Publish the public values of state. Returns the list of keys that changed, and wakes
+        up anyone waiting for changes if there were any.
+        """
+        changes={}
+        for key,value in state.items():
+            if key[0]=="_":
+                continue
+            try:
+                encoded=json.dumps(value,default=str)
+            except (TypeError,ValueError) as e:
+                _LOGGER.debug(f"Unable to serialise state {key}: {e!r}")
+                continue
+            if self.encoded.get(key)!=encoded:
+                changes[key]=(value,encoded)
+
+        if changes:
+            with self.condition:
+                self.version+=1
+                for key,(value,encoded) in changes.items():
+                    self.values[key]=value
+                    self.encoded[key]=encoded
+                    self.changed[key]=self.version
+                self.condition.notify_all()
+
+        return list(changes)
+
+    def tag(self,version):
+        """
+        Returns the version as given to clients, e.g. in event ids, prefixed with the epoch
+        """
+        return f"{self.epoch}-{version}"
+
+    def parse(self,tag):
+        """
+        Returns the version from a tag(), or 0 if it is from another run. Raises ValueError if it
+        isn't a version at all
+        """
+        epoch,_,version=str(tag).rpartition("-")
+        version=int(version)
+        return version if epoch==self.epoch else 0
+
+    def _since(self,version):
+        if version>self.version:
+            version=0
+        return [key for key,changed in self.changed.items() if changed>version]
+
+    def snapshot(self):
+        """
+        Returns (version, dict) of all public values
+        """
+        with self.condition:
+            return self.version,dict(self.values)
+
+    def changes_since(self,version,keys=None):
+        """
+        Returns (version, dict) of the values that have changed since the version given,
+        optionally only those in keys
+        """
+        with self.condition:
+            return self.version,{key: self.values[key] for key in self._since(version) if keys is None or key in keys}
+
+    def json(self,version=0):
+        """
+        Returns (version, str) of a JSON object of the values changed since the version given
+        (by default, all of them), built from the stored encodings
+        """
+        with self.condition:
+            data=",".join(f"{json.dumps(key)}:{self.encoded[key]}" for key in self._since(version))
+            return self.version,f"{{{data}}}"
+
+    #############################################################################
+    # Server-Sent Events. Clients first receive a "state" event holding all values, then a
+    # "delta" event holding the changes for each version. The tagged version is used as the
+    # event id, so that clients that reconnect with Last-Event-ID receive only what they missed.
+
+    def event(self,since=None):
+        """
+        Returns (version, bytes) of a "state" event if since is None, otherwise a "delta"
+        event of the changes since then.
+        """
+        if since is None:
+            version,data=self.json()
+            return version,f"id: {self.tag(version)}\nevent: state\ndata: {data}\n\n".encode("utf-8")
+
+        last_event=self.last_event
+        if last_event is not None and last_event[0]==since and last_event[1]==self.version:
+            return last_event[1],last_event[2]
+
+        version,data=self.json(since)
+        message=f"id: {self.tag(version)}\nevent: delta\ndata: {data}\n\n".encode("utf-8")
+        self.last_event=(since,version,message)
+        return version,message
+
+    def wait(self,after,timeout=None):
+        """
+        Wait for the version to move on from the one given. Returns (version, bytes) of a
+        "delta" event, or (after, None) on timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.version!=after,timeout):
+                return after,None
+        return self.event(after)
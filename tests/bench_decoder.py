@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Checks StatusFrame.decode() against the previous implementation (slicing the response into
+attributes in set_amp_limit(), then converting some of them from hex in openeo.main()) on
+the frames produced by the simulator, that corrupt frames are rejected, and reports the time
+each takes per frame. StatusFrame.decode() also checks the checksum and every field, so
+expect it to be somewhat slower.
+
+Doesn't need any hardware:
+
+    python3 tests/bench_decoder.py
+"""
+import sys,os,time,math
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from EO_comms.Simulator import Simulator
+from EO_comms.StatusFrame import StatusFrame
+
+class legacyStatusClass:
+    pass
+
+def legacy_decode(response):
+    # sendSerialCommand() and set_amp_limit() before StatusFrame
+    response=response.decode("ascii")[1:-3]
+    status=legacyStatusClass()
+    result="!"+response
+    status.version = result[1:3]
+    status.current_switch_setting = result[3]
+    status.control_pilot_voltage = result[4:7]
+    status.charge_duty = result[7:10]
+    status.plug_present_voltage = result[10:13]
+    status.live_voltage = result[13:16]
+    status.neutral_voltage = result[16:19]
+    status.daylight_detection = result[19:22]
+    status.mains_frequency = result[22:25]
+    status.charger_state = result[25:27]
+    status.relay_state = result[27]
+    status.plug_state = result[28]
+    status.HUB_duty_limit = result[29:32]
+    status.charge_duty_timer = result[32:36]
+    status.station_uptime = result[36:40]
+    status.charge_time = result[40:44]
+    status.state_of_mains = result[44:46]
+    status.cp_line_state = result[46]
+    status.station_ID = result[47]
+    status.random_value = result[48:50]
+    status.max_current = result[50:53]
+    status.persistant_ID = result[53:61]
+    status.watchdog_current = result[61:64]
+    status.watchdog_time = result[64:67]
+    status.p1_current = round(int(result[67:70], 16) / 10, 2)
+    status.p2_current = round(int(result[70:73], 16) / 10, 2)
+    status.p3_current = round(int(result[73:76], 16) / 10, 2)
+    status.eco_7_switch = result[76]
+    status.checksum = result[77:79]
+    # ...and the conversions in openeo.main()
+    status.live_voltage = int(status.live_voltage, 16)
+    status.version = int(status.version, 16)
+    status.current_switch_setting = int(status.current_switch_setting, 16)
+    status.mains_frequency = int(status.mains_frequency, 16)
+    status.charger_state = int(status.charger_state, 16)
+    return status
+
+def frames():
+    # A spread of responses from the simulator, through the charger states
+    simulator=Simulator(latency=0)
+    responses=[]
+    for duty in (0,0,0,100,100,100,533,533,0):
+        simulator.duty=duty
+        simulator.state=simulator.next_state()
+        responses.append(simulator.status().encode())
+    return responses
+
+def bench(name,decode,responses,iterations):
+    start=time.perf_counter()
+    for i in range(iterations):
+        for response in responses:
+            decode(response)
+    elapsed=time.perf_counter()-start
+    print(f"{name:>8}: {elapsed/iterations/len(responses)*1e6:8.2f} us/frame")
+
+if __name__ == "__main__":
+    iterations=int(sys.argv[1]) if len(sys.argv)>1 else 20000
+    responses=frames()
+
+    for response in responses:
+        legacy=legacy_decode(response)
+        status=StatusFrame.decode(response)
+        for name in StatusFrame._fields:
+            assert getattr(legacy,name)==getattr(status,name) or not isinstance(getattr(legacy,name),(int,float)), name
+        assert status.encode()==response
+    # Corrupt frames are rejected
+    assert StatusFrame.decode(responses[0][:-3]+b"00\r") is None
+    assert StatusFrame.decode(responses[0][:-1]) is None
+    assert StatusFrame.decode(responses[0][:5]+b"G"+responses[0][6:]) is None
+
+    bench("legacy",legacy_decode,responses,iterations)
+    bench("current",StatusFrame.decode,responses,iterations)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of MiniPro2 receive, against a fake SPI device that emulates the UART
+registers, with the controller's response arriving over a few milliseconds. Reports the
+number of SPI transactions and the time taken per response, for the current rx() and the
+previous implementation (a full RXLVL/FIFO/LSR poll for the whole of recv_delay).
+
+Doesn't need any hardware:
+
+    python3 tests/bench_minipro2.py
+"""
+import sys,os,time,types
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+# The hardware and application modules that MiniPro2 imports are replaced with stand-ins
+spidev=types.ModuleType("spidev")
+GPIO=types.ModuleType("RPi.GPIO")
+GPIO.BCM=GPIO.OUT=GPIO.IN=GPIO.LOW=GPIO.HIGH=GPIO.FALLING=GPIO.PUD_UP=0
+for name in ("setwarnings","setmode","setup","output"):
+    setattr(GPIO,name,lambda *args,**kwargs: None)
+RPi=types.ModuleType("RPi")
+RPi.GPIO=GPIO
+from openeoMetrics import metricsRegistryClass
+globalState=types.ModuleType("globalState")
+globalState.metrics=metricsRegistryClass()
+sys.modules.update({"spidev":spidev,"RPi":RPi,"RPi.GPIO":GPIO,"globalState":globalState})
+try:
+    import serial
+except ImportError:
+    # pyserial is only used by the HomeHub base class
+    sys.modules["serial"]=types.ModuleType("serial")
+
+from EO_comms.MiniPro2 import MiniPro2
+
+def checksum(text):
+    return "%02X" % (sum(text.encode("ascii")) & 0xFF)
+
+# A typical response to a SET_LIMIT command
+PAYLOAD="!"+"0"*76
+RESPONSE=(PAYLOAD+checksum(PAYLOAD)+"\r").encode("ascii")
+
+class fakeSpiClass:
+    """
+    Emulates the UART's RXLVL, LSR and RX FIFO registers. The response starts arriving
+    LATENCY seconds after the reset of the FIFO in tx(), at BYTES_PER_SECOND.
+    """
+    LATENCY=0.004
+    BYTES_PER_SECOND=11520
+
+    def __init__(self):
+        self.transactions=0
+        self.start=time.monotonic()
+        self.taken=0
+
+    def arrived(self):
+        elapsed=time.monotonic()-self.start-self.LATENCY
+        return min(len(RESPONSE),max(0,int(elapsed*self.BYTES_PER_SECOND)))
+
+    def xfer2(self,data):
+        self.transactions+=1
+        command=data[0]
+        reg=(command>>3)&0x0F
+        if command & 0x80:
+            if reg==MiniPro2.REG_RXLVL:
+                return [0,self.arrived()-self.taken]
+            if reg==0:
+                count=len(data)-1
+                chunk=RESPONSE[self.taken:self.taken+count]
+                self.taken+=count
+                return [0]+list(chunk)
+            return [0]*len(data)
+        if reg==MiniPro2.REG_FCR_IIR:
+            # FIFO reset, the response starts arriving now
+            self.start=time.monotonic()
+            self.taken=0
+        return [0]*len(data)
+
+def legacy_rx(self, recv_delay=3):
+    # MiniPro2.rx() before frame detection and burst FIFO reads
+    data=b""
+    enter_timestamp = time.monotonic()
+    overrun=0
+    while (recv_delay is not None) and (time.monotonic() - enter_timestamp < recv_delay):
+        bytesWaiting=int(self._register_get(self.REG_RXLVL))
+        if (bytesWaiting>0):
+            rxbuffer = [0x80] + [0x00] * bytesWaiting
+            data += bytes(self.spi.xfer2(rxbuffer)[1:])
+            OverrunError = int(self._register_get(self.REG_LSR)) & self.BIT_OVERRUN
+            if (OverrunError!=0):
+                overrun=overrun+1
+        else:
+            time.sleep(0.001)
+    return None if overrun else bytes(data)
+
+def bench(name,rx,iterations):
+    comms=MiniPro2.__new__(MiniPro2)
+    comms.spi=fakeSpiClass()
+    start=time.perf_counter()
+    cpu=time.process_time()
+    for i in range(iterations):
+        comms.tx("+0000000000")
+        response=rx(comms,recv_delay=0.5)
+        assert response==RESPONSE, response
+    elapsed=time.perf_counter()-start
+    cpu=time.process_time()-cpu
+    print(f"{name:>8}: {elapsed/iterations*1000:8.2f} ms/response  {cpu/iterations*1000:6.2f} ms CPU/response  "
+          f"{comms.spi.transactions/iterations:7.1f} SPI transactions/response")
+
+if __name__ == "__main__":
+    iterations=int(sys.argv[1]) if len(sys.argv)>1 else 10
+    bench("legacy",legacy_rx,iterations)
+    bench("current",MiniPro2.rx,iterations)
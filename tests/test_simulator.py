@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Runs openeoChargerClass against the EO_comms simulator, so the hardware I/O thread, the
+controller protocol and the status decoding are exercised without the hardware:
+
+    python3 -m pytest tests/test_simulator.py
+"""
+import sys,os,time,tempfile
+
+os.environ["OPENEO_SIMULATOR"]="1"
+os.environ["OPENEO_SIMULATOR_LATENCY"]="0"
+os.environ.setdefault("OPENEO_CONFIG_DIR",tempfile.mkdtemp(prefix="openeo-test-"))
+os.environ.setdefault("OPENEO_LOOP_INTERVAL","0.1")
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+import globalState
+from openeoCharger import openeoChargerClass
+from EO_comms.Simulator import Simulator
+from EO_comms.StatusFrame import StatusFrame
+
+def wait_for(condition,timeout=5):
+    deadline=time.monotonic()+timeout
+    while not condition():
+        assert time.monotonic()<deadline, "timed out"
+        time.sleep(globalState.LOOP_INTERVAL/2)
+
+def test_charger_with_simulator():
+    # As set up by openeo.main(), here without any plugins loaded
+    globalState.stateDict["_moduleDict"]={}
+    charger=openeoChargerClass()
+    assert isinstance(charger.rs485,Simulator)
+    assert charger.connected
+    assert charger.my_address==Simulator.SERIAL
+
+    # The I/O thread sends the limit, and the simulated vehicle starts charging at it
+    wait_for(lambda: charger.set_amp_limit(16) and charger.status.charger_state==Simulator.STATE_CHARGING)
+    assert isinstance(charger.status,StatusFrame)
+    assert charger.status.HUB_duty_limit==round(16/0.06)
+    assert charger.status.persistant_ID.strip()!=""
+
+    # CT readings are sampled alongside
+    wait_for(lambda: charger.set_amp_limit(16) and charger.current_vehicle==16)
+    assert charger.current_site>=16
+    assert charger.current_solar==0
+
+    # If the main loop stops requesting a limit, the I/O thread stops the charge
+    wait_for(lambda: charger.rs485.duty==0)
+    assert charger.limit_request.get()==16